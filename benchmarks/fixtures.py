@@ -0,0 +1,309 @@
+"""
+Stand-in schema and synthetic data for the benchmarks.
+
+The DDL covers the columns synergetic reads and writes, in types SQLite and SQL Server both accept, so the same
+fixtures can back a local SQLite file or a throwaway SQL Server. generate() fills it with a school's worth of data.
+"""
+import datetime as dt
+import random
+import re
+
+from sqlalchemy import MetaData, Table, text
+
+TABLES = {
+    'FileSemesters': """
+        CREATE TABLE FileSemesters (
+            FileYear INTEGER NOT NULL,
+            FileSemester INTEGER NOT NULL,
+            Description VARCHAR(50),
+            StartDate DATETIME,
+            EndDate DATETIME,
+            SystemCurrentFlag INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (FileYear, FileSemester)
+        )""",
+    'SubjectClasses': """
+        CREATE TABLE SubjectClasses (
+            SubjectClassesSeq INTEGER PRIMARY KEY,
+            FileType VARCHAR(5) NOT NULL,
+            FileYear INTEGER NOT NULL,
+            FileSemester INTEGER NOT NULL,
+            ClassCampus VARCHAR(5) NOT NULL,
+            ClassCode VARCHAR(15) NOT NULL,
+            Description VARCHAR(50),
+            StaffID INTEGER
+        )""",
+    'AttendanceMaster': """
+        CREATE TABLE AttendanceMaster (
+            AttendanceMasterSeq INTEGER PRIMARY KEY,
+            CreatedDate DATETIME,
+            CreatedByID INTEGER,
+            ModifiedDate DATETIME,
+            ModifiedByID INTEGER,
+            FileType VARCHAR(5),
+            FileYear INTEGER,
+            FileSemester INTEGER,
+            ClassCampus VARCHAR(5),
+            ClassCode VARCHAR(15),
+            StaffID INTEGER,
+            AttendanceDate DATETIME,
+            AttendancePeriod INTEGER,
+            AttendanceDateTimeFrom DATETIME,
+            AttendanceDateTimeTo DATETIME,
+            AttendanceDayNumber INTEGER,
+            TimetableGroup VARCHAR(5),
+            ClassCancelledFlag INTEGER,
+            AttendanceOfficerModeFlag INTEGER,
+            SystemProcessNumber INTEGER,
+            SeqLinkedTo INTEGER,
+            MarkRollAsMultiPeriodFlag INTEGER
+        )""",
+    'tAttendances': """
+        CREATE TABLE tAttendances (
+            AttendanceSeq INTEGER PRIMARY KEY,
+            AttendanceMasterSeq INTEGER NOT NULL,
+            ID INTEGER NOT NULL,
+            PossibleAbsenceCode VARCHAR(15),
+            PossibleDescription VARCHAR(255),
+            AttendedFlag INTEGER,
+            ModifiedDate DATETIME,
+            ModifiedByID INTEGER,
+            PossibleReasonCode VARCHAR(15),
+            UserFlag1 INTEGER,
+            UserFlag2 INTEGER,
+            UserFlag3 INTEGER,
+            UserFlag4 INTEGER,
+            UserFlag5 INTEGER,
+            LateArrivalFlag INTEGER,
+            LatearrivalTime DATETIME,
+            EarlyDepartureFlag INTEGER,
+            EarlyDepartureTime DATETIME,
+            AbsenceEventsSeq INTEGER,
+            NonAttendCreatedAbsenceEventsFlag INTEGER
+        )""",
+    'AbsenceEvents': """
+        CREATE TABLE AbsenceEvents (
+            AbsenceEventsSeq INTEGER PRIMARY KEY,
+            MasterAbsenceEventsSeq INTEGER,
+            SupersededByAbsenceEventsSeq INTEGER,
+            AbsenceEventTypeCode VARCHAR(15),
+            ID INTEGER NOT NULL,
+            EventDateTime DATETIME,
+            EventDate DATETIME,
+            EventTime DATETIME,
+            CreatedByID INTEGER,
+            CreatedDate DATETIME,
+            ModifiedByID INTEGER,
+            ModifiedDate DATETIME,
+            AbsenceTypeCode VARCHAR(15),
+            AbsenceReasonCode VARCHAR(15),
+            SchoolInOutStatus VARCHAR(5),
+            EnteredInAdvanceFlag INTEGER,
+            SystemGeneratedFlag INTEGER,
+            SystemProcessNumber INTEGER,
+            NoteReceivedFlag INTEGER,
+            ContactMadeFlag INTEGER,
+            ApprovedFlag INTEGER,
+            ReportedByID INTEGER,
+            ReportedByName VARCHAR(50),
+            EventComment VARCHAR(255),
+            LeavingWithID INTEGER,
+            AbsencePeriodCode VARCHAR(15),
+            ContactReceivedFlag INTEGER,
+            MasterEndAbsenceEventsSeq INTEGER,
+            NoteMadeFlag INTEGER,
+            TerminalCode VARCHAR(15),
+            LinkedID INTEGER
+        )""",
+    'StaffSchedule': """
+        CREATE TABLE StaffSchedule (
+            StaffScheduleSeq INTEGER PRIMARY KEY,
+            StaffID INTEGER,
+            ScheduleDateTimeFrom DATETIME,
+            ScheduleDateTimeTo DATETIME,
+            ScheduleDateFrom DATE,
+            ScheduleTimeFrom TIME,
+            ScheduleDateTo DATE,
+            ScheduleTimeTo TIME,
+            Comment VARCHAR(255),
+            Room VARCHAR(15),
+            TeamCode VARCHAR(15),
+            ParentStaffScheduleSeq INTEGER,
+            AttendanceCreatedByDate DATETIME,
+            AttendanceCreatedByID INTEGER,
+            AttendanceModifiedByDate DATETIME,
+            AttendanceModifiedByID INTEGER,
+            SubjectClassesSeq INTEGER,
+            TimesheetsSeq INTEGER,
+            ClassType VARCHAR(15),
+            ModifiedDateTime DATETIME,
+            LocationCode VARCHAR(15),
+            StaffScheduleTypeCode VARCHAR(15),
+            Results VARCHAR(255),
+            SummaryNotes VARCHAR(255),
+            Opposition VARCHAR(50),
+            ConfirmedDateTime DATETIME,
+            ConfirmedByUser VARCHAR(50),
+            SystemProcessNumber INTEGER
+        )""",
+    'StaffScheduleStudentClasses': """
+        CREATE TABLE StaffScheduleStudentClasses (
+            StaffScheduleStudentClassesSeq INTEGER PRIMARY KEY,
+            StaffScheduleSeq INTEGER NOT NULL,
+            FileType VARCHAR(5),
+            FileYear INTEGER,
+            FileSemester INTEGER,
+            ClassCampus VARCHAR(5),
+            ClassCode VARCHAR(15),
+            ID INTEGER,
+            AttendedFlag INTEGER,
+            SubjectClassesSeq INTEGER,
+            ConfirmedDateTime DATETIME,
+            ConfirmedByUser VARCHAR(50),
+            PossibleAbsenceCode VARCHAR(15),
+            PossibleReasonCode VARCHAR(15),
+            PossibleDescription VARCHAR(255)
+        )""",
+    'luAbsenceType': """
+        CREATE TABLE luAbsenceType (
+            Code VARCHAR(15) PRIMARY KEY,
+            Description VARCHAR(50),
+            AbsentFlag INTEGER
+        )""",
+    'luAbsenceReason': """
+        CREATE TABLE luAbsenceReason (
+            Code VARCHAR(15) PRIMARY KEY,
+            Description VARCHAR(50)
+        )""",
+    'luAbsenceEventType': """
+        CREATE TABLE luAbsenceEventType (
+            Code VARCHAR(15) PRIMARY KEY,
+            Description VARCHAR(50)
+        )""",
+}
+
+ABSENCE_TYPES = [('ABS', 'Absent', 1), ('ILL', 'Illness', 1), ('EXCUR', 'Excursion', 0), ('LATE', 'Late', 0)]
+ABSENCE_REASONS = [('SPO', 'Sport'), ('MED', 'Medical'), ('FAM', 'Family')]
+ABSENCE_EVENT_TYPES = [('SIGNIN', 'Signed in'), ('SIGNOUT', 'Signed out'), ('ABS', 'Absence')]
+
+# Default (small) school. Multiply with the scale argument of generate()
+STUDENTS = 1200
+CLASSES = 300
+CLASS_SIZE = 25
+DAYS = 20
+PERIODS = 6
+
+_SEQ_PRIMARY_KEY = re.compile(r"(\w+Seq) INTEGER PRIMARY KEY")
+
+
+def create_schema(engine):
+    """Drops and recreates every stand-in table"""
+    with engine.begin() as conn:
+        for table_name, ddl in TABLES.items():
+            if engine.dialect.name == 'mssql':
+                # Seqs are identity columns in Synergetic, SQLite gets the equivalent from INTEGER PRIMARY KEY
+                ddl = _SEQ_PRIMARY_KEY.sub(r"\1 INT IDENTITY(1, 1) PRIMARY KEY", ddl)
+            conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+            conn.execute(text(ddl))
+
+
+def generate(engine, scale=1.0, fileyear=2042, filesemester=1, seed=0):
+    """
+    Fills the stand-in schema with synthetic data for one semester
+
+    :param engine: Engine of the stand-in database
+    :param scale: Multiplies the number of students, classes and days
+    :param fileyear: FileYear of the generated semester (it's flagged as current)
+    :param filesemester: FileSemester of the generated semester
+    :param seed: Seed for the random data, so runs are reproducible
+    :return: dict of table name -> number of rows
+    """
+    rng = random.Random(seed)
+    n_students = int(STUDENTS * scale)
+    n_classes = int(CLASSES * scale)
+    n_days = max(int(DAYS * scale), 1)
+    start = dt.datetime(fileyear, 2, 1)
+    students = list(range(10000, 10000 + n_students))
+
+    classes = [{'SubjectClassesSeq': seq, 'FileType': 'A', 'FileYear': fileyear, 'FileSemester': filesemester,
+                'ClassCampus': 'S', 'ClassCode': f"{7 + seq % 6}C{seq:04d}", 'Description': f"Class {seq}",
+                'StaffID': 50000 + seq % 100}
+               for seq in range(1, n_classes + 1)]
+    rosters = {cls['ClassCode']: rng.sample(students, min(CLASS_SIZE, n_students)) for cls in classes}
+
+    masters = []
+    attendances = []
+    events = []
+    for day in range(n_days):
+        date = start + dt.timedelta(days=day + 2 * (day // 5))  # Skip weekends
+        for period in range(1, PERIODS + 1):
+            time_from = date + dt.timedelta(hours=8 + period)
+            # Each class meets in one period a day
+            for cls in classes[period - 1::PERIODS]:
+                seq = len(masters) + 1
+                masters.append({'AttendanceMasterSeq': seq, 'CreatedDate': time_from,
+                                'CreatedByID': cls['StaffID'], 'ModifiedDate': time_from,
+                                'ModifiedByID': cls['StaffID'], 'FileType': 'A', 'FileYear': fileyear,
+                                'FileSemester': filesemester, 'ClassCampus': 'S', 'ClassCode': cls['ClassCode'],
+                                'StaffID': cls['StaffID'], 'AttendanceDate': date, 'AttendancePeriod': period,
+                                'AttendanceDateTimeFrom': time_from,
+                                'AttendanceDateTimeTo': time_from + dt.timedelta(minutes=50),
+                                'AttendanceDayNumber': day % 10 + 1, 'TimetableGroup': 'T',
+                                'ClassCancelledFlag': 0, 'AttendanceOfficerModeFlag': 0, 'SystemProcessNumber': 0,
+                                'MarkRollAsMultiPeriodFlag': 0})
+                for student in rosters[cls['ClassCode']]:
+                    attended = rng.random() > 0.08
+                    late = attended and rng.random() < 0.03
+                    attendances.append({'AttendanceSeq': len(attendances) + 1, 'AttendanceMasterSeq': seq,
+                                        'ID': student, 'PossibleAbsenceCode': '' if attended else
+                                        rng.choice(ABSENCE_TYPES)[0], 'PossibleDescription': '',
+                                        'AttendedFlag': int(attended), 'ModifiedDate': time_from,
+                                        'ModifiedByID': cls['StaffID'], 'PossibleReasonCode': '',
+                                        'LateArrivalFlag': int(late),
+                                        'LatearrivalTime': time_from + dt.timedelta(minutes=10) if late else None,
+                                        'EarlyDepartureFlag': 0, 'AbsenceEventsSeq': 0,
+                                        'NonAttendCreatedAbsenceEventsFlag': 0})
+        for student in rng.sample(students, max(n_students // 50, 1)):
+            event_time = date + dt.timedelta(hours=rng.randint(9, 14))
+            events.append({'AbsenceEventsSeq': len(events) + 1, 'MasterAbsenceEventsSeq': len(events) + 1,
+                           'AbsenceEventTypeCode': 'SIGNOUT', 'ID': student, 'EventDateTime': event_time,
+                           'EventDate': date, 'EventTime': event_time, 'CreatedByID': 99999,
+                           'CreatedDate': event_time, 'ModifiedByID': 99999, 'ModifiedDate': event_time,
+                           'AbsenceTypeCode': 'ABS', 'AbsenceReasonCode': 'MED', 'SchoolInOutStatus': 'Out'})
+
+    semesters = [{'FileYear': fileyear, 'FileSemester': filesemester, 'Description': 'Stand-in',
+                  'StartDate': start, 'EndDate': start + dt.timedelta(days=n_days * 7 // 5 + 2),
+                  'SystemCurrentFlag': 1},
+                 {'FileYear': fileyear - 1, 'FileSemester': filesemester, 'Description': 'Previous',
+                  'StartDate': start.replace(year=fileyear - 1), 'EndDate': start.replace(year=fileyear - 1, month=6),
+                  'SystemCurrentFlag': 0}]
+    rows = {
+        'FileSemesters': semesters,
+        'SubjectClasses': classes,
+        'AttendanceMaster': masters,
+        'tAttendances': attendances,
+        'AbsenceEvents': events,
+        'luAbsenceType': [dict(zip(('Code', 'Description', 'AbsentFlag'), row)) for row in ABSENCE_TYPES],
+        'luAbsenceReason': [dict(zip(('Code', 'Description'), row)) for row in ABSENCE_REASONS],
+        'luAbsenceEventType': [dict(zip(('Code', 'Description'), row)) for row in ABSENCE_EVENT_TYPES],
+    }
+    with engine.begin() as conn:
+        for table_name, table_rows in rows.items():
+            if table_rows:
+                _insert(conn, table_name, table_rows)
+    return {table_name: len(table_rows) for table_name, table_rows in rows.items()}
+
+
+def _insert(conn, table_name, rows):
+    # Inserting through the reflected table stores values the way SQLAlchemy reads them back (e.g. SQLite datetimes)
+    table = Table(table_name, MetaData(), autoload_with=conn)
+    columns = list(rows[0])
+    for row in rows:
+        for column in row:
+            if column not in columns:
+                columns.append(column)
+    identity = conn.dialect.name == 'mssql' and _SEQ_PRIMARY_KEY.search(TABLES[table_name])
+    if identity:
+        conn.execute(text(f"SET IDENTITY_INSERT {table_name} ON"))
+    conn.execute(table.insert(), [{column: row.get(column) for column in columns} for row in rows])
+    if identity:
+        conn.execute(text(f"SET IDENTITY_INSERT {table_name} OFF"))
@@ -0,0 +1,191 @@
+"""
+Benchmark suite for synergetic, run against a local stand-in database.
+
+Builds the stand-in schema (see fixtures.py), fills it with a synthetic school, points synergetic's default engine at
+it and times startup, the create_* factories, the from_* lookups, roll writes and extraction. Results are written as
+JSON so runs from different versions can be compared.
+
+Example usage (from the repository root):
+python -m benchmarks.run --out before.json
+python -m benchmarks.run --out after.json --compare before.json
+
+Pass --url to use another stand-in, e.g. a throwaway SQL Server: --url "mssql+pyodbc://@SynBench". Benchmarks that
+need SQL Server (write_rolls) are skipped on SQLite.
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from benchmarks import fixtures
+
+
+def timed(fn, ops=1, repeat=3, setup=None):
+    """
+    Runs fn repeat times and reports the median
+
+    :param fn: Function to time
+    :param ops: Operations fn performs, for the ops_per_second figure
+    :param repeat: Number of runs
+    :param setup: Called (untimed) before each run
+    :return: dict of the result
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    seconds = statistics.median(times)
+    return {'seconds': seconds, 'min_seconds': min(times), 'ops': ops,
+            'ops_per_second': ops / seconds if seconds else None}
+
+
+def bench_import(url, repeat=5):
+    code = "import time; t = time.perf_counter(); import synergetic; print(time.perf_counter() - t)"
+    env = dict(os.environ, SYNERGETIC_URL_TEST=url, SYNERGETIC_DEFAULT_ENGINE='test')
+    times = [float(subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True,
+                                  check=True).stdout) for _ in range(repeat)]
+    return {'seconds': statistics.median(times), 'min_seconds': min(times), 'ops': 1,
+            'ops_per_second': 1 / statistics.median(times)}
+
+
+def run(url, scale=1.0, repeat=3):
+    os.environ['SYNERGETIC_URL_TEST'] = url
+    os.environ['SYNERGETIC_DEFAULT_ENGINE'] = 'test'
+    engine = create_engine(url)
+    fixtures.create_schema(engine)
+    counts = fixtures.generate(engine, scale=scale)
+
+    results = {'import': bench_import(url)}
+
+    import synergetic
+    from synergetic import reflection
+    from synergetic.Attendance import Attendance, Extract, Rolls
+    from synergetic.School import Subjects
+    from synergetic.Schedule import Schedule
+    from synergetic.synergetic_session import Synergetic
+
+    tables = list(fixtures.TABLES)
+    results['reflect_all_tables'] = timed(lambda: [reflection.mapped(table) for table in tables], ops=len(tables),
+                                          repeat=1)
+
+    n = 2000
+    results['create_attendance_master'] = timed(
+        lambda: [Attendance.create_attendance_master(ClassCode='7C0001', StaffID=50001) for _ in range(n)],
+        ops=n, repeat=repeat)
+    results['create_t_attendances'] = timed(
+        lambda: [Attendance.create_t_attendances(ID=10000 + i, AttendedFlag=i % 2) for i in range(n)],
+        ops=n, repeat=repeat)
+    results['create_staff_schedule'] = timed(
+        lambda: [Schedule.create_staff_schedule(StaffID=50001, SubjectClassesSeq=1) for _ in range(n)],
+        ops=n, repeat=repeat)
+
+    SubjectClasses = Subjects.SubjectClasses
+    seqs = list(range(1, counts['SubjectClasses'] + 1))
+    with engine.connect() as conn:
+        keys = [tuple(row) for row in conn.exec_driver_sql(
+            "SELECT ClassCode, FileType, FileYear, FileSemester, ClassCampus FROM SubjectClasses")]
+    results['from_seq_uncached'] = timed(lambda: [SubjectClasses.from_seq(seq) for seq in seqs], ops=len(seqs),
+                                         repeat=repeat, setup=Subjects.invalidate_cache)
+    results['from_seq_cached'] = timed(lambda: [SubjectClasses.from_seq(seq) for seq in seqs], ops=len(seqs),
+                                       repeat=repeat)
+    results['from_seqs_bulk'] = timed(lambda: SubjectClasses.from_seqs(seqs), ops=len(seqs), repeat=repeat,
+                                      setup=Subjects.invalidate_cache)
+    results['from_class_codes_bulk'] = timed(lambda: SubjectClasses.from_class_codes(keys), ops=len(keys),
+                                             repeat=repeat, setup=Subjects.invalidate_cache)
+
+    rolls = 50
+    students = fixtures.CLASS_SIZE
+
+    def build_rolls():
+        start = dt.datetime(2042, 6, 1, 9)
+        return [(Attendance.create_attendance_master(ClassCode=key[0], StaffID=50001, AttendanceDateTimeFrom=start),
+                 [Attendance.create_t_attendances(ID=10000 + j, AttendedFlag=1) for j in range(students)])
+                for key in keys[:rolls]]
+
+    def add_rolls():
+        with Synergetic.test() as session:
+            for master, roll in build_rolls():
+                session.add(master)
+                session.flush()
+                for student in roll:
+                    student.AttendanceMasterSeq = master.AttendanceMasterSeq
+                session.add_all(roll)
+            session.rollback()
+
+    results['roll_write_session_add'] = timed(add_rolls, ops=rolls * (students + 1), repeat=repeat)
+    if engine.dialect.name == 'mssql':
+        def bulk_rolls():
+            with Synergetic.test() as session:
+                Rolls.write_rolls(session, build_rolls())
+                session.rollback()
+        results['roll_write_bulk'] = timed(bulk_rolls, ops=rolls * (students + 1), repeat=repeat)
+    else:
+        results['roll_write_bulk'] = {'skipped': 'write_rolls needs SQL Server'}
+
+    def extract():
+        return sum(len(batch) for batch in Extract.stream_attendance(include_absence_events=True))
+    results['stream_attendance'] = timed(extract, ops=counts['tAttendances'], repeat=repeat)
+
+    return {
+        'meta': {
+            'synergetic_path': os.path.dirname(synergetic.__file__),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': engine.dialect.name,
+            'scale': scale,
+            'rows': counts,
+            'timestamp': dt.datetime.now().isoformat(timespec='seconds'),
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline):
+    """Prints each benchmark's median against a baseline run. Ratios above 1 are slower"""
+    print(f"{'benchmark':<30}{'baseline s':>14}{'current s':>14}{'ratio':>10}")
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name, {})
+        if 'seconds' not in result or 'seconds' not in before:
+            continue
+        ratio = result['seconds'] / before['seconds'] if before['seconds'] else float('inf')
+        print(f"{name:<30}{before['seconds']:>14.4f}{result['seconds']:>14.4f}{ratio:>10.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="Stand-in database URL. Defaults to a temporary SQLite file")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplies the size of the synthetic school")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs of each benchmark, the median is reported")
+    parser.add_argument('--out', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="A previous results file to compare against")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.url or f"sqlite:///{os.path.join(tmp, 'synergetic_bench.db')}"
+        os.environ.setdefault('SYNERGETIC_CACHE_DIR', '')
+        report = run(url, scale=args.scale, repeat=args.repeat)
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
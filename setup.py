@@ -20,6 +20,7 @@ setup(
     ],
     description="An interface for working with the Synergetic Database",
     install_requires=requirements,
+    extras_require={'analytics': ['numpy'], 'parquet': ['pyarrow']},
     license="MIT license",
     include_package_data=True,
     keywords='synergetic',
@@ -0,0 +1,196 @@
+"""
+Vectorised attendance analytics.
+
+Attendance is loaded once into columnar NumPy arrays (an AttendanceFrame) and every aggregation is a handful of
+array operations (np.unique + np.bincount), so a whole school semester is summarised without a Python loop over rows.
+NumPy is an optional dependency, only needed for this module.
+
+Example usage:
+frame = load_attendance(fileyear=2022, filesemester=1)
+rates = attendance_rate(frame, by='student')
+streaks = absence_streaks(frame, min_length=3)
+"""
+from collections import namedtuple
+
+from synergetic import reflection
+from synergetic.Attendance.Extract import BATCH_SIZE, attendance_query, stream_query
+
+try:
+    import numpy as np
+except ImportError:  # Optional, only needed for analytics
+    np = None
+
+GROUPINGS = ('student', 'class', 'period', 'date', 'week')
+
+Rates = namedtuple('Rates', 'keys attended total rate')
+Counts = namedtuple('Counts', 'keys counts')
+Breakdown = namedtuple('Breakdown', 'keys codes counts')  # counts[i, j] is the count of codes[j] for keys[i]
+Streaks = namedtuple('Streaks', 'student_id start end length')
+
+
+class AttendanceFrame:
+    """
+    Attendance as parallel arrays, one element per tAttendances row.
+    class_code and absence_code hold indexes into class_codes and absence_codes.
+    """
+
+    def __init__(self, attendance_seq, student_id, attended, late, early, absence_code, absence_codes, class_code,
+                 class_codes, period, date, start):
+        self.attendance_seq = attendance_seq
+        self.student_id = student_id
+        self.attended = attended
+        self.late = late
+        self.early = early
+        self.absence_code = absence_code
+        self.absence_codes = absence_codes
+        self.class_code = class_code
+        self.class_codes = class_codes
+        self.period = period
+        self.date = date
+        self.start = start
+
+    def __len__(self):
+        return len(self.attendance_seq)
+
+
+def load_attendance(date_from=None, date_to=None, fileyear=None, filesemester=None, classcode=None, student_id=None,
+                    batch_size=BATCH_SIZE, engine=None, cache=None):
+    """
+    Reads just the columns the analytics need into an AttendanceFrame. Takes the same filters as
+    Extract.attendance_query, and a result_cache.ResultCache to read closed semesters from (see
+    Extract.stream_attendance).
+
+    :return: AttendanceFrame
+    """
+    if np is None:
+        raise ImportError("numpy is required for synergetic.Attendance.Analytics")
+    AttendanceMaster = reflection.mapped('AttendanceMaster').__table__
+    tAttendances = reflection.mapped('tAttendances').__table__
+    query = attendance_query(date_from=date_from, date_to=date_to, fileyear=fileyear, filesemester=filesemester,
+                             classcode=classcode, student_id=student_id).with_only_columns(
+        tAttendances.c.AttendanceSeq,
+        tAttendances.c.ID,
+        tAttendances.c.AttendedFlag,
+        tAttendances.c.LateArrivalFlag,
+        tAttendances.c.EarlyDepartureFlag,
+        tAttendances.c.PossibleAbsenceCode,
+        AttendanceMaster.c.ClassCode,
+        AttendanceMaster.c.AttendancePeriod,
+        AttendanceMaster.c.AttendanceDate,
+        AttendanceMaster.c.AttendanceDateTimeFrom,
+    )
+
+    columns = [[] for _ in range(10)]
+    for batch in stream_query(query, batch_size, engine, cache, fileyear, filesemester):
+        for i, values in enumerate(zip(*batch)):
+            columns[i].extend(values)
+    return from_columns(*columns)
+
+
+def from_columns(attendance_seq, student_id, attended, late, early, absence_code, class_code, period, date, start):
+    """
+    Builds an AttendanceFrame from plain sequences, e.g. rows already pulled with Extract.stream_attendance
+
+    :return: AttendanceFrame
+    """
+    if np is None:
+        raise ImportError("numpy is required for synergetic.Attendance.Analytics")
+    absence_codes, absence_code = np.unique([(code or '').strip() for code in absence_code], return_inverse=True)
+    class_codes, class_code = np.unique([(code or '').strip() for code in class_code], return_inverse=True)
+    return AttendanceFrame(
+        attendance_seq=np.asarray(attendance_seq, dtype=np.int64),
+        student_id=np.asarray(student_id, dtype=np.int64),
+        attended=np.asarray(attended, dtype=bool),
+        late=np.asarray(late, dtype=bool),
+        early=np.asarray(early, dtype=bool),
+        absence_code=absence_code.astype(np.int32),
+        absence_codes=absence_codes,
+        class_code=class_code.astype(np.int32),
+        class_codes=class_codes,
+        period=np.asarray(period, dtype=np.int32),
+        date=np.asarray(date, dtype='datetime64[D]'),
+        start=np.asarray(start, dtype='datetime64[s]'),
+    )
+
+
+def attendance_rate(frame, by='student'):
+    """
+    Proportion of rolls attended per group
+
+    :param frame: AttendanceFrame
+    :param by: One of GROUPINGS
+    :return: Rates of parallel arrays
+    """
+    keys, inverse = _group(frame, by)
+    total = np.bincount(inverse, minlength=len(keys))
+    attended = np.bincount(inverse, weights=frame.attended, minlength=len(keys)).astype(np.int64)
+    return Rates(keys, attended, total, attended / np.maximum(total, 1))
+
+
+def late_arrivals(frame, by='student'):
+    """Number of late arrivals per group"""
+    keys, inverse = _group(frame, by)
+    return Counts(keys, np.bincount(inverse, weights=frame.late, minlength=len(keys)).astype(np.int64))
+
+
+def early_departures(frame, by='student'):
+    """Number of early departures per group"""
+    keys, inverse = _group(frame, by)
+    return Counts(keys, np.bincount(inverse, weights=frame.early, minlength=len(keys)).astype(np.int64))
+
+
+def absence_breakdown(frame, by='student'):
+    """
+    Count of each PossibleAbsenceCode per group, for rolls that weren't attended
+
+    :return: Breakdown, counts is a (groups x codes) matrix
+    """
+    keys, inverse = _group(frame, by)
+    absent = ~frame.attended
+    n_codes = len(frame.absence_codes)
+    combined = inverse[absent].astype(np.int64) * n_codes + frame.absence_code[absent]
+    counts = np.bincount(combined, minlength=len(keys) * n_codes).reshape(len(keys), n_codes)
+    return Breakdown(keys, frame.absence_codes, counts)
+
+
+def absence_streaks(frame, min_length=2):
+    """
+    Runs of consecutive rolls a student didn't attend, in the order of their classes
+
+    :param frame: AttendanceFrame
+    :param min_length: Shortest run to report
+    :return: Streaks of parallel arrays, the start and end are class start datetimes
+    """
+    order = np.lexsort((frame.start, frame.student_id))
+    student_id = frame.student_id[order]
+    start = frame.start[order]
+    absent = ~frame.attended[order]
+    new_student = np.ones(len(order), dtype=bool)
+    new_student[1:] = student_id[1:] != student_id[:-1]
+    previous_absent = np.zeros(len(order), dtype=bool)
+    previous_absent[1:] = absent[:-1]
+    run_start = absent & (new_student | ~previous_absent)
+    run_id = np.cumsum(run_start) - 1
+    lengths = np.bincount(run_id[absent], minlength=int(run_start.sum()))
+    starts = np.flatnonzero(run_start)
+    keep = lengths >= min_length
+    starts, lengths = starts[keep], lengths[keep]
+    ends = starts + lengths - 1
+    return Streaks(student_id[starts], start[starts], start[ends], lengths)
+
+
+def _group(frame, by):
+    if by == 'student':
+        return np.unique(frame.student_id, return_inverse=True)
+    if by == 'class':
+        keys, inverse = np.unique(frame.class_code, return_inverse=True)
+        return frame.class_codes[keys], inverse
+    if by == 'period':
+        return np.unique(frame.period, return_inverse=True)
+    if by == 'date':
+        return np.unique(frame.date, return_inverse=True)
+    if by == 'week':
+        # Monday of the week. Day 0 (1970-01-01) was a Thursday
+        days = frame.date.astype(np.int64)
+        return np.unique((days - (days + 3) % 7).astype('datetime64[D]'), return_inverse=True)
+    raise ValueError(f"by must be one of {GROUPINGS}, not {by!r}")
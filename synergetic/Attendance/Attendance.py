@@ -1,46 +1,29 @@
-from sqlalchemy.ext.automap import automap_base
-from sqlalchemy.orm import Session
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.sql import select
 import datetime as dt
-from synergetic.School import CURRENT_YEAR, CURRENT_SEMESTER
-import synergetic.synergetic_session as syn
-
-# Only deal with these tables
-syn.metadata.reflect(syn.engine, only=['AttendanceMaster',
-                                       'tAttendances',
-                                       'AbsenceEvents',
-                                       'luAbsenceType',
-                                       'luAbsenceReason',
-                                       'luAbsenceEventType'])
-
-Base = automap_base(metadata=syn.metadata)
-Base.prepare()
-
-AttendanceMaster = Base.classes.AttendanceMaster
-tAttendances = Base.classes.tAttendances
-AbsenceEvents = Base.classes.AbsenceEvents
-luAbsenceType = Base.classes.luAbsenceType
-luAbsenceReason = Base.classes.luAbsenceReason
-luAbsenceEventType = Base.classes.luAbsenceEventType
-
-# Used to stop output command as SQL alchemy doesn't seem to allow "OUTPUT INTO"
+from synergetic import reflection
+from synergetic.School import school
+from synergetic.Attendance import Lookups
+
+# Only deal with these tables. They're reflected on first use, see synergetic.reflection
+# implicit_returning is turned off to stop the OUTPUT command as SQL alchemy doesn't seem to allow "OUTPUT INTO"
 # https://techcommunity.microsoft.com/t5/sql-server-blog/update-with-output-clause-8211-triggers-8211-and-sqlmoreresults/ba-p/383457
 # https://stackoverflow.com/questions/47513622/dealing-with-triggers-in-sqlalchemy-when-inserting-into-table
-AttendanceMaster.__table__.implicit_returning = False
-tAttendances.__table__.implicit_returning = False
-
+reflection.register('AttendanceMaster', implicit_returning=False)
+reflection.register('tAttendances', implicit_returning=False)
+reflection.register('AbsenceEvents')
+reflection.register('luAbsenceType')
+reflection.register('luAbsenceReason')
+reflection.register('luAbsenceEventType')
 
-# AbsenceEvents.__table__.implicit_returning = False
+__getattr__ = reflection.module_getattr(__name__, 'AttendanceMaster', 'tAttendances', 'AbsenceEvents',
+                                        'luAbsenceType', 'luAbsenceReason', 'luAbsenceEventType')
 
 
 # noinspection PyPep8Naming
-def create_attendance_master(CreatedDate=dt.datetime.now(), CreatedByID=None, ModifiedDate=None, ModifiedByID=None,
+def create_attendance_master(CreatedDate=None, CreatedByID=None, ModifiedDate=None, ModifiedByID=None,
                              FileType='A', FileYear=None, FileSemester=None, ClassCampus='S', ClassCode='Test',
-                             StaffID=99999, AttendanceDate=dt.datetime.combine(dt.date.today(), dt.time(0, 0, 0)),
-                             AttendancePeriod=10, AttendanceDateTimeFrom=dt.datetime.now(), AttendanceDateTimeTo=None,
-                             AttendanceDayNumber=None, TimetableGroup=None, ClassCancelledFlag=0,
-                             AttendanceOfficerModeFlag=0, SystemProcessNumber=0, SeqLinkedTo=None,
+                             StaffID=99999, AttendanceDate=None, AttendancePeriod=10, AttendanceDateTimeFrom=None,
+                             AttendanceDateTimeTo=None, AttendanceDayNumber=None, TimetableGroup=None,
+                             ClassCancelledFlag=0, AttendanceOfficerModeFlag=0, SystemProcessNumber=0, SeqLinkedTo=None,
                              MarkRollAsMultiPeriodFlag=None):
     """
     /Essentially the class the roll is being taken for. Can sometimes get multiple entries per class, perhaps when the
@@ -50,7 +33,7 @@ def create_attendance_master(CreatedDate=dt.datetime.now(), CreatedByID=None, Mo
     The value of StaffID will populate CreatedByID and ModifiedByID if you don't pass those
 
     //AttendanceMasterSeq: Primary Key. No need to specify
-    :param CreatedDate: Time the roll was taken
+    :param CreatedDate: Time the roll was taken, defaults to now
     :param CreatedByID: ID of the staff member taking the roll  (different to StaffID when a relief is taken)
     :param ModifiedDate: Appears to be the same as CreatedDate for most cases
     :param ModifiedByID: Appears to be the same as CreatedByID for most cases
@@ -60,9 +43,9 @@ def create_attendance_master(CreatedDate=dt.datetime.now(), CreatedByID=None, Mo
     :param ClassCampus: ClassCampus for the class
     :param ClassCode: ClassCode for the class
     :param StaffID: Staff Member of the class  (different to StaffID when a CreatedByID is taken)
-    :param AttendanceDate: Date of class
+    :param AttendanceDate: Date of class, defaults to today
     :param AttendancePeriod: Period of class
-    :param AttendanceDateTimeFrom: Start datetime of class
+    :param AttendanceDateTimeFrom: Start datetime of class, defaults to now
     :param AttendanceDateTimeTo: End datetime of class
     :param AttendanceDayNumber: Day in timetable cycle
     :param TimetableGroup: Always 'T' for academic classes
@@ -74,6 +57,13 @@ def create_attendance_master(CreatedDate=dt.datetime.now(), CreatedByID=None, Mo
     :return:
     """
 
+    # Defaults that depend on the time (or the current semester) are resolved per call, not once at import
+    if CreatedDate is None:
+        CreatedDate = dt.datetime.now()
+    if AttendanceDate is None:
+        AttendanceDate = dt.datetime.combine(dt.date.today(), dt.time(0, 0, 0))
+    if AttendanceDateTimeFrom is None:
+        AttendanceDateTimeFrom = dt.datetime.now()
     if CreatedByID is None:
         CreatedByID = StaffID
     if ModifiedDate is None:
@@ -81,9 +71,9 @@ def create_attendance_master(CreatedDate=dt.datetime.now(), CreatedByID=None, Mo
     if ModifiedByID is None:
         ModifiedByID = CreatedByID
     if FileYear is None:
-        FileYear = CURRENT_YEAR
+        FileYear = school.current_term().FileYear
     if FileSemester is None:
-        FileSemester = CURRENT_SEMESTER
+        FileSemester = school.current_term().FileSemester
     if AttendanceDateTimeTo is None:
         AttendanceDateTimeTo = AttendanceDateTimeFrom + dt.timedelta(minutes=50)
     if TimetableGroup is None:
@@ -91,7 +81,7 @@ def create_attendance_master(CreatedDate=dt.datetime.now(), CreatedByID=None, Mo
     if MarkRollAsMultiPeriodFlag is None:
         MarkRollAsMultiPeriodFlag = 1 if SeqLinkedTo is not None else 0
     args = {key: value for key, value in locals().items() if value is not None}
-    return AttendanceMaster(**args)
+    return reflection.mapped('AttendanceMaster')(**args)
 
 
 def create_t_attendances(AttendanceMasterSeq=None, ID=88888, PossibleAbsenceCode='', PossibleDescription='',
@@ -108,12 +98,12 @@ def create_t_attendances(AttendanceMasterSeq=None, ID=88888, PossibleAbsenceCode
     //AttendanceSeq: Primary Key. No need to specify
     :param AttendanceMasterSeq: Foreign key, the roll record it's being entered for
     :param ID: Student ID
-    :param PossibleAbsenceCode: From luAbsenceType
-    :param PossibleDescription: Custom absence comment
+    :param PossibleAbsenceCode: From luAbsenceType, an InvalidCodeError is raised if it isn't there
+    :param PossibleDescription: Custom absence comment. Left blank, it's the absence code's luAbsenceType Description
     :param AttendedFlag: Attended? 1 or 0
     :param ModifiedDate: datetime record was modified
     :param ModifiedByID: Who modified
-    :param PossibleReasonCode: Not used, probably links to luAbsenceReason
+    :param PossibleReasonCode: Not used, probably links to luAbsenceReason. Raises an InvalidCodeError if it isn't there
     :param UserFlag1: Can't determine the use
     :param UserFlag2
     :param UserFlag3
@@ -136,14 +126,18 @@ def create_t_attendances(AttendanceMasterSeq=None, ID=88888, PossibleAbsenceCode
         EarlyDepartureTime = dt.datetime.now()
     if NonAttendCreatedAbsenceEventsFlag is None:
         NonAttendCreatedAbsenceEventsFlag = 1 if AbsenceEventsSeq > 0 and AttendedFlag == 1 else 0
+    # Checked against the cached lookup tables so bad codes fail here, not when a large transaction commits
+    Lookups.absence_types.validate(PossibleAbsenceCode, 'PossibleAbsenceCode')
+    Lookups.absence_reasons.validate(PossibleReasonCode, 'PossibleReasonCode')
+    if not PossibleDescription and PossibleAbsenceCode:
+        PossibleDescription = Lookups.absence_types.get(PossibleAbsenceCode, {}).get('Description') or ''
     # Get all the local arguments, but filtered out the ones that haven't been set
     args = {key: value for key, value in locals().items() if value is not None}
-    return tAttendances(**args)
+    return reflection.mapped('tAttendances')(**args)
 
 
 def create_absence_events(SupersededByAbsenceEventsSeq=None, AbsenceEventTypeCode=None, ID=77777,
-                          EventDateTime=dt.datetime.combine(dt.date.today(), dt.time(0, 0, 0)),
-                          EventDate=None, EventTime=None, CreatedByID=-99999,
+                          EventDateTime=None, EventDate=None, EventTime=None, CreatedByID=-99999,
                           CreatedDate=None, ModifiedByID=None, ModifiedDate=None,
                           AbsenceTypeCode='', AbsenceReasonCode='', SchoolInOutStatus='', EnteredInAdvanceFlag=0,
                           SystemGeneratedFlag=0, SystemProcessNumber=0, NoteReceivedFlag=0, ContactMadeFlag=0,
@@ -153,14 +147,15 @@ def create_absence_events(SupersededByAbsenceEventsSeq=None, AbsenceEventTypeCod
     """
     /Each Absence event/
 
-    Creates an absence events instance with default arguments.
+    Creates an absence events instance with default arguments. The codes are checked against the cached lookup tables
+    and an InvalidCodeError is raised for any that aren't there.
     Important args: ID, CreatedByID, AbsencePeriodCode
     //AbsenceEventsSeq: Primary Key. No need to specify
     //MasterAbsenceEventsSeq: Mostly the same as AbsenceEventsSeq, but is different when both 'in' and 'out' is entered
     :param SupersededByAbsenceEventsSeq: Superseded by another AbsenceEvent?
     :param AbsenceEventTypeCode: Type, linked to luAbsenceEventType
     :param ID: Student ID
-    :param EventDateTime: datetime
+    :param EventDateTime: datetime, defaults to midnight today
     :param EventDate: date
     :param EventTime: time
     :param CreatedByID: ID of person marking event
@@ -191,6 +186,8 @@ def create_absence_events(SupersededByAbsenceEventsSeq=None, AbsenceEventTypeCod
     """
 
     # MasterAbsenceEventsSeq should default to AbsenceEventsSeq except when SchoolInOutStatus is both 'In' and 'Out'
+    if EventDateTime is None:
+        EventDateTime = dt.datetime.combine(dt.date.today(), dt.time(0, 0, 0))
     if EventDate is None:
         EventDate = EventDateTime
     if CreatedDate is None:
@@ -201,6 +198,10 @@ def create_absence_events(SupersededByAbsenceEventsSeq=None, AbsenceEventTypeCod
         ModifiedDate = EventDateTime
     if AbsenceTypeCode is None:
         AbsenceTypeCode = "ABS"
+    # Checked against the cached lookup tables so bad codes fail here, not when a large transaction commits
+    Lookups.absence_event_types.validate(AbsenceEventTypeCode, 'AbsenceEventTypeCode')
+    Lookups.absence_types.validate(AbsenceTypeCode, 'AbsenceTypeCode')
+    Lookups.absence_reasons.validate(AbsenceReasonCode, 'AbsenceReasonCode')
 
     args = {key: value for key, value in locals().items() if value is not None}
-    return AttendanceMaster(**args)
+    return reflection.mapped('AbsenceEvents')(**args)
@@ -0,0 +1,114 @@
+"""
+Streaming extraction of attendance history.
+
+Rows are read as plain tuples (not ORM objects) over a streamed result and handed out in fixed size batches, so
+exporting years of tAttendances uses the same memory as exporting a day.
+"""
+from sqlalchemy.sql import select
+from synergetic import reflection
+import synergetic.synergetic_session as syn
+
+BATCH_SIZE = 10000
+
+
+def attendance_query(date_from=None, date_to=None, fileyear=None, filesemester=None, classcode=None, student_id=None,
+                     include_absence_events=False):
+    """
+    Builds the select of tAttendances joined to their AttendanceMaster (and optionally AbsenceEvents), ordered by
+    AttendanceSeq. Every tAttendances column is included; AttendanceMaster and AbsenceEvents columns are included too,
+    prefixed with 'Master' and 'Event' where the name is already taken (e.g. MasterModifiedDate).
+
+    :param date_from: First AttendanceDate to include
+    :param date_to: Last AttendanceDate to include
+    :param fileyear: FileYear of the roll
+    :param filesemester: FileSemester of the roll
+    :param classcode: A ClassCode, or a list of them
+    :param student_id: A student ID, or a list of them
+    :param include_absence_events: Outer join the AbsenceEvents linked through AbsenceEventsSeq
+    :return: sqlalchemy Select
+    """
+    AttendanceMaster = reflection.mapped('AttendanceMaster').__table__
+    tAttendances = reflection.mapped('tAttendances').__table__
+    columns = list(tAttendances.columns)
+    taken = set(tAttendances.columns.keys())
+    columns += _prefixed(AttendanceMaster, 'Master', taken)
+    from_clause = tAttendances.join(AttendanceMaster,
+                                    tAttendances.c.AttendanceMasterSeq == AttendanceMaster.c.AttendanceMasterSeq)
+    if include_absence_events:
+        AbsenceEvents = reflection.mapped('AbsenceEvents').__table__
+        columns += _prefixed(AbsenceEvents, 'Event', taken)
+        from_clause = from_clause.outerjoin(AbsenceEvents,
+                                            tAttendances.c.AbsenceEventsSeq == AbsenceEvents.c.AbsenceEventsSeq)
+
+    query = select(*columns).select_from(from_clause).order_by(tAttendances.c.AttendanceSeq)
+    if date_from is not None:
+        query = query.where(AttendanceMaster.c.AttendanceDate >= date_from)
+    if date_to is not None:
+        query = query.where(AttendanceMaster.c.AttendanceDate <= date_to)
+    if fileyear is not None:
+        query = query.where(AttendanceMaster.c.FileYear == fileyear)
+    if filesemester is not None:
+        query = query.where(AttendanceMaster.c.FileSemester == filesemester)
+    if classcode is not None:
+        query = query.where(_matches(AttendanceMaster.c.ClassCode, classcode))
+    if student_id is not None:
+        query = query.where(_matches(tAttendances.c.ID, student_id))
+    return query
+
+
+def stream_attendance(batch_size=BATCH_SIZE, engine=None, cache=None, **filters):
+    """
+    Yields batches of attendance rows, reading them from the server as they're needed.
+
+    Example usage:
+    for batch in stream_attendance(fileyear=2021, include_absence_events=True):
+        writer.write_rows(batch)
+
+    :param batch_size: Rows per batch
+    :param engine: Name of the engine to read from, see synergetic_session.get_engine
+    :param cache: A result_cache.ResultCache. Closed semesters (filtered by a single fileyear and filesemester) are then
+    read from it when it has them, and the rows come back as namedtuples
+    :param filters: Passed to attendance_query
+    :return: Generator of lists of rows
+    """
+    yield from stream_query(attendance_query(**filters), batch_size, engine, cache, filters.get('fileyear'),
+                            filters.get('filesemester'))
+
+
+def stream_query(query, batch_size=BATCH_SIZE, engine=None, cache=None, fileyear=None, filesemester=None):
+    """
+    Yields batches of any select's rows, streamed from the server on one connection so only a batch is held at a time.
+    stream_attendance, Analytics, partitioned and result_cache all read through this.
+
+    :param query: sqlalchemy Select
+    :param batch_size: Rows per batch
+    :param engine: Name of the engine to read from, see synergetic_session.get_engine
+    :param cache: A result_cache.ResultCache to read closed semesters from, see stream_attendance
+    :param fileyear: FileYear the query is scoped to, used by the cache
+    :param filesemester: FileSemester the query is scoped to, used by the cache
+    :return: Generator of lists of rows
+    """
+    if cache is not None:
+        yield from cache.stream(query, fileyear, filesemester, batch_size, engine)
+        return
+    with syn.get_engine(engine).connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=batch_size).execute(query)
+        for batch in result.partitions(batch_size):
+            yield batch
+
+
+def _prefixed(table, prefix, taken):
+    columns = []
+    for col in table.columns:
+        if col.name in taken:
+            columns.append(col.label(f"{prefix}{col.name}"))
+        else:
+            columns.append(col)
+            taken.add(col.name)
+    return columns
+
+
+def _matches(column, value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return column.in_(list(value))
+    return column == value
@@ -0,0 +1,84 @@
+"""
+In-memory caches of the absence lookup tables.
+
+Each table is read whole in one query the first time it's needed and kept for TTL seconds, so the factory functions
+can validate codes (and callers can look up descriptions and flags) with a dict lookup instead of a query per row.
+"""
+import threading
+import time
+
+from sqlalchemy.sql import select
+from synergetic import reflection
+from synergetic.convert import normalise
+import synergetic.errors as errors
+import synergetic.synergetic_session as syn
+
+# Seconds before a lookup table is read again
+TTL = 600
+
+
+class LookupTable:
+    """
+    A lookup table (e.g. luAbsenceType) cached as a dict of code -> row, where a row is a dict of column -> value.
+
+    Example usage:
+    absence_types.get('ABS')['Description']
+    absence_types.validate('ABS', 'PossibleAbsenceCode')
+    """
+
+    def __init__(self, table_name, ttl=TTL):
+        self.table_name = table_name
+        self.ttl = ttl
+        self._rows = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def rows(self):
+        """The whole table, reading it again if it's older than ttl"""
+        with self._lock:
+            if self._rows is None or time.monotonic() - self._loaded_at > self.ttl:
+                self._rows = self._load()
+                self._loaded_at = time.monotonic()
+            return self._rows
+
+    def refresh(self):
+        """Reads the table again on next use"""
+        with self._lock:
+            self._rows = None
+
+    def get(self, code, default=None):
+        return self.rows().get(normalise(code), default)
+
+    def __contains__(self, code):
+        return normalise(code) in self.rows()
+
+    def validate(self, code, param):
+        """
+        Raises an InvalidCodeError if code isn't in the table. Blank codes are allowed, they're the default for
+        records without one
+
+        :param code: Code to check
+        :param param: Name of the parameter the code was passed as, for the error message
+        :return:
+        """
+        if code is None or normalise(code) == '':
+            return
+        if code not in self:
+            raise errors.InvalidCodeError(f"{param}={code!r} is not a code in {self.table_name}")
+
+    def _load(self):
+        table = reflection.mapped(self.table_name).__table__
+        key = list(table.primary_key.columns)[0].name
+        with syn.get_engine().connect() as conn:
+            return {normalise(row[key]): dict(row) for row in conn.execute(select(table)).mappings()}
+
+
+absence_types = LookupTable('luAbsenceType')
+absence_reasons = LookupTable('luAbsenceReason')
+absence_event_types = LookupTable('luAbsenceEventType')
+
+
+def refresh_all():
+    """Reads every lookup table again on next use"""
+    for table in (absence_types, absence_reasons, absence_event_types):
+        table.refresh()
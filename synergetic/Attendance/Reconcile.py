@@ -0,0 +1,188 @@
+"""
+Reconciles AbsenceEvents (sign ins and sign outs) against class rolls.
+
+Each student's events are turned into sorted intervals they were out of school, and swept against their sorted
+class windows (AttendanceMaster.AttendanceDateTimeFrom/To), so a whole school day is O((events + rolls) log n)
+rather than a query per roll. The result is a list of tAttendances updates:
+- out for the whole class: AttendedFlag = 0 with the event's absence type
+- back during the class: LateArrivalFlag and LatearrivalTime
+- left during the class: EarlyDepartureFlag and EarlyDepartureTime
+each with AbsenceEventsSeq set to the event responsible.
+
+Example usage:
+with Synergetic.test() as session:
+    updates = reconcile_day(session, dt.date(2042, 3, 14))
+    session.commit()
+"""
+import datetime as dt
+from collections import defaultdict
+
+from sqlalchemy import select
+from synergetic import reflection
+from synergetic.convert import day_start
+from synergetic.Attendance import Rolls
+
+_SIGN_IN = 'in'
+_SIGN_OUT = 'out'
+
+
+def load_events(conn, date_from, date_to):
+    """AbsenceEvents from date_from up to and including date_to that haven't been superseded"""
+    AbsenceEvents = reflection.mapped('AbsenceEvents').__table__
+    query = select(
+        AbsenceEvents.c.AbsenceEventsSeq,
+        AbsenceEvents.c.ID,
+        AbsenceEvents.c.EventDateTime,
+        AbsenceEvents.c.SchoolInOutStatus,
+        AbsenceEvents.c.AbsenceTypeCode,
+    ).where(
+        AbsenceEvents.c.EventDateTime >= day_start(date_from),
+        AbsenceEvents.c.EventDateTime < day_start(date_to) + dt.timedelta(days=1),
+        (AbsenceEvents.c.SupersededByAbsenceEventsSeq.is_(None)) | (AbsenceEvents.c.SupersededByAbsenceEventsSeq == 0),
+    )
+    return [row._mapping for row in conn.execute(query)]
+
+
+def load_rolls(conn, date_from, date_to):
+    """Every student's roll entry for classes from date_from up to and including date_to"""
+    AttendanceMaster = reflection.mapped('AttendanceMaster').__table__
+    tAttendances = reflection.mapped('tAttendances').__table__
+    query = select(
+        tAttendances.c.AttendanceSeq,
+        tAttendances.c.ID,
+        tAttendances.c.AttendedFlag,
+        tAttendances.c.PossibleAbsenceCode,
+        tAttendances.c.LateArrivalFlag,
+        tAttendances.c.LatearrivalTime,
+        tAttendances.c.EarlyDepartureFlag,
+        tAttendances.c.EarlyDepartureTime,
+        tAttendances.c.AbsenceEventsSeq,
+        AttendanceMaster.c.AttendanceDateTimeFrom,
+        AttendanceMaster.c.AttendanceDateTimeTo,
+    ).select_from(
+        tAttendances.join(AttendanceMaster,
+                          tAttendances.c.AttendanceMasterSeq == AttendanceMaster.c.AttendanceMasterSeq)
+    ).where(
+        AttendanceMaster.c.AttendanceDate >= day_start(date_from),
+        AttendanceMaster.c.AttendanceDate < day_start(date_to) + dt.timedelta(days=1),
+    )
+    return [row._mapping for row in conn.execute(query)]
+
+
+def absence_intervals(events):
+    """
+    Turns one student's events into the intervals they were out of school
+
+    An 'Out' starts an interval that ends at the next 'In' (or the end of the day). An 'In' with no 'Out' before it
+    that day means they arrived late, so it ends an interval starting at midnight. An event that's neither is an
+    absence for the whole day.
+
+    :param events: The student's events, with EventDateTime, SchoolInOutStatus, AbsenceEventsSeq and AbsenceTypeCode
+    :return: List of (start, end, event) sorted by start
+    """
+    intervals = []
+    out = None
+    for event in sorted(events, key=lambda event: event['EventDateTime']):
+        time = event['EventDateTime']
+        status = (event['SchoolInOutStatus'] or '').strip().lower()
+        if out is not None and out['EventDateTime'].date() != time.date():
+            intervals.append((out['EventDateTime'], day_start(out['EventDateTime']) + dt.timedelta(days=1), out))
+            out = None
+        if status == _SIGN_OUT:
+            if out is None:
+                out = event
+        elif status == _SIGN_IN:
+            if out is not None:
+                intervals.append((out['EventDateTime'], time, out))
+                out = None
+            else:
+                intervals.append((day_start(time), time, event))
+        else:
+            intervals.append((day_start(time), day_start(time) + dt.timedelta(days=1), event))
+    if out is not None:
+        intervals.append((out['EventDateTime'], day_start(out['EventDateTime']) + dt.timedelta(days=1), out))
+    intervals.sort(key=lambda interval: interval[0])
+    return intervals
+
+
+def reconcile(events, rolls):
+    """
+    Works out the tAttendances updates the events imply. Rolls that already match are left out.
+
+    :param events: AbsenceEvents rows (see load_events)
+    :param rolls: tAttendances rows with their class window (see load_rolls)
+    :return: List of dicts of tAttendances columns to update, each with its AttendanceSeq
+    """
+    events_by_student = defaultdict(list)
+    for event in events:
+        events_by_student[event['ID']].append(event)
+    rolls_by_student = defaultdict(list)
+    for roll in rolls:
+        if roll['ID'] in events_by_student:
+            rolls_by_student[roll['ID']].append(roll)
+
+    updates = []
+    for student_id, student_rolls in rolls_by_student.items():
+        intervals = absence_intervals(events_by_student[student_id])
+        student_rolls.sort(key=lambda roll: roll['AttendanceDateTimeFrom'])
+        first = 0  # Intervals before this end before every remaining class starts
+        for roll in student_rolls:
+            start, end = roll['AttendanceDateTimeFrom'], roll['AttendanceDateTimeTo']
+            while first < len(intervals) and intervals[first][1] <= start:
+                first += 1
+            changes = {}
+            i = first
+            while i < len(intervals) and intervals[i][0] < end:
+                out_from, out_to, event = intervals[i]
+                i += 1
+                if out_to <= start:
+                    continue
+                if out_from <= start and out_to >= end:
+                    changes['AttendedFlag'] = 0
+                    changes['PossibleAbsenceCode'] = (event['AbsenceTypeCode'] or '').strip() or 'ABS'
+                    changes['AbsenceEventsSeq'] = event['AbsenceEventsSeq']
+                    break
+                if out_from <= start:
+                    changes['LateArrivalFlag'] = 1
+                    changes['LatearrivalTime'] = out_to
+                    changes['AbsenceEventsSeq'] = event['AbsenceEventsSeq']
+                else:
+                    # The first time they left, if they left more than once
+                    changes.setdefault('EarlyDepartureFlag', 1)
+                    changes.setdefault('EarlyDepartureTime', out_from)
+                    changes.setdefault('AbsenceEventsSeq', event['AbsenceEventsSeq'])
+            if changes.get('AttendedFlag') == 0:
+                for column in ('LateArrivalFlag', 'LatearrivalTime', 'EarlyDepartureFlag', 'EarlyDepartureTime'):
+                    changes.pop(column, None)
+            if any(roll.get(column) != value for column, value in changes.items()):
+                changes['AttendanceSeq'] = roll['AttendanceSeq']
+                updates.append(changes)
+    return updates
+
+
+def apply_updates(session, updates):
+    """
+    Writes the updates with one executemany UPDATE per set of columns changed
+
+    :param session: A Synergetic session, commit it afterwards as usual
+    :param updates: From reconcile
+    :return: Number of rows updated
+    """
+    return Rolls.update_many(session.connection(), reflection.mapped('tAttendances').__table__, 'AttendanceSeq',
+                             updates)
+
+
+def reconcile_day(session, date_from, date_to=None):
+    """
+    Loads a day's (or a range of days') events and rolls, reconciles them and writes the updates
+
+    :param session: A Synergetic session, commit it afterwards as usual
+    :param date_from: First day
+    :param date_to: Last day, defaults to date_from
+    :return: The updates written
+    """
+    date_to = date_from if date_to is None else date_to
+    conn = session.connection()
+    updates = reconcile(load_events(conn, date_from, date_to), load_rolls(conn, date_from, date_to))
+    apply_updates(session, updates)
+    return updates
@@ -0,0 +1,275 @@
+"""
+Bulk roll writing.
+
+Writing rolls through session.add means one INSERT per row, plus an identity fetch per AttendanceMaster because
+implicit_returning has to be off (the tables have triggers). write_rolls instead stages every master and student into
+temp tables with pyodbc's fast_executemany, then inserts them all server side. The generated AttendanceMasterSeqs are
+captured with MERGE ... OUTPUT INTO, which unlike a plain OUTPUT is allowed on tables with triggers, and the
+tAttendances are keyed to their masters with a join, so a whole year level is a handful of statements.
+
+sync_roll is for rolls that may already exist, e.g. a teacher re-submitting: it loads the class's existing roll in one
+query and only writes the rows that differ, instead of adding a second master or deleting and re-inserting.
+"""
+from collections import defaultdict, namedtuple
+
+from sqlalchemy import bindparam, select, update
+from synergetic import reflection
+
+_MASTER_STAGING = '#RollMasters'
+_STUDENT_STAGING = '#RollStudents'
+_SEQ_STAGING = '#RollSeqs'
+
+# Identifies the class and period a roll is for
+ROLL_KEY = ('FileType', 'FileYear', 'FileSemester', 'ClassCampus', 'ClassCode', 'AttendanceDate', 'AttendancePeriod')
+# Written along with a change, but a difference in these alone isn't a change
+_AUDIT_COLUMNS = {'CreatedDate', 'CreatedByID', 'ModifiedDate', 'ModifiedByID'}
+# create_attendance_master defaults these to now, so they're only synced on an existing roll when asked for
+_TIME_COLUMNS = {'AttendanceDateTimeFrom', 'AttendanceDateTimeTo'}
+
+RollDiff = namedtuple('RollDiff', 'master_seq master_updated inserted updated deleted unchanged')
+
+
+def write_rolls(session, rolls):
+    """
+    Inserts many rolls in a handful of statements. Runs inside the session's transaction, so commit (or rollback) the
+    session afterwards as usual.
+
+    Example usage:
+    rolls = [(create_attendance_master(ClassCode='10ENG01', StaffID=51087),
+              [create_t_attendances(ID=51047, AttendedFlag=1), create_t_attendances(ID=51048, AttendedFlag=0)])]
+    with Synergetic.test() as session:
+        seqs = write_rolls(session, rolls)
+        session.commit()
+
+    :param session: A Synergetic session
+    :param rolls: Iterable of (AttendanceMaster, [tAttendances, ...]) pairs, e.g. built with create_attendance_master
+    and create_t_attendances. Rows can also be dicts of column values. The tAttendances' AttendanceMasterSeq is ignored,
+    they're linked to the master they're paired with
+    :return: List of the new AttendanceMasterSeqs, in the same order as rolls
+    """
+    rolls = [(master, list(students)) for master, students in rolls]
+    if not rolls:
+        return []
+    master_table = reflection.mapped('AttendanceMaster').__table__
+    student_table = reflection.mapped('tAttendances').__table__
+    # Staged per set of columns given a value, so a column one row leaves unset gets its database default rather than
+    # NULL. Rolls built the same way (e.g. all with create_attendance_master) share a set, so it's usually one each
+    master_groups = _group_by_columns(master_table, enumerate(master for master, _ in rolls),
+                                      exclude={'AttendanceMasterSeq'})
+    student_groups = _group_by_columns(student_table, ((roll_number, student)
+                                                       for roll_number, (_, roll) in enumerate(rolls)
+                                                       for student in roll),
+                                       exclude={'AttendanceSeq', 'AttendanceMasterSeq'})
+
+    conn = session.connection()
+    cursor = conn.connection.cursor()
+    cursor.fast_executemany = True
+    try:
+        # Leftovers from a failed call on this pooled connection
+        _drop_staging(cursor)
+        cursor.execute(f"CREATE TABLE {_SEQ_STAGING} (RollNumber int PRIMARY KEY, AttendanceMasterSeq int NOT NULL)")
+        for columns, group in master_groups.items():
+            _create_staging(cursor, _MASTER_STAGING, master_table.name, columns)
+            _stage(cursor, _MASTER_STAGING, columns, [[roll_number] + _values(master, columns)
+                                                      for roll_number, master in group])
+            cols = ', '.join(f'[{col}]' for col in columns)
+            source_cols = ', '.join(f's.[{col}]' for col in columns)
+            cursor.execute(f"MERGE INTO [{master_table.name}] USING {_MASTER_STAGING} AS s ON 1 = 0 "
+                           f"WHEN NOT MATCHED THEN INSERT ({cols}) VALUES ({source_cols}) "
+                           f"OUTPUT s.RollNumber, inserted.AttendanceMasterSeq "
+                           f"INTO {_SEQ_STAGING} (RollNumber, AttendanceMasterSeq);")
+            cursor.execute(f"DROP TABLE {_MASTER_STAGING}")
+        for columns, group in student_groups.items():
+            _create_staging(cursor, _STUDENT_STAGING, student_table.name, columns)
+            _stage(cursor, _STUDENT_STAGING, columns, [[roll_number] + _values(student, columns)
+                                                       for roll_number, student in group])
+            cols = ', '.join(f'[{col}]' for col in columns)
+            source_cols = ', '.join(f's.[{col}]' for col in columns)
+            cursor.execute(f"INSERT INTO [{student_table.name}] (AttendanceMasterSeq, {cols}) "
+                           f"SELECT r.AttendanceMasterSeq, {source_cols} FROM {_STUDENT_STAGING} AS s "
+                           f"JOIN {_SEQ_STAGING} AS r ON r.RollNumber = s.RollNumber")
+            cursor.execute(f"DROP TABLE {_STUDENT_STAGING}")
+        cursor.execute(f"SELECT AttendanceMasterSeq FROM {_SEQ_STAGING} ORDER BY RollNumber")
+        seqs = [row[0] for row in cursor.fetchall()]
+        _drop_staging(cursor)
+    finally:
+        cursor.close()
+    return seqs
+
+
+def sync_roll(session, master, students, delete_missing=False, update_times=False):
+    """
+    Makes the roll for a class and period match the one given, writing only what's changed. Runs inside the session's
+    transaction, so commit the session afterwards as usual.
+
+    The existing master and its tAttendances are loaded in one query. Students are matched on ID: new ones are
+    inserted, ones with different values get one batched UPDATE per set of changed columns, and matching ones aren't
+    touched. If the class already has more than one master for the period, the latest is synced. An existing master's
+    AttendanceDateTimeFrom and AttendanceDateTimeTo are kept unless update_times is set, as create_attendance_master
+    defaults them to now and a re-submitted roll would otherwise always rewrite its master.
+
+    Example usage:
+    master = create_attendance_master(ClassCode='10ENG01', StaffID=51087, AttendanceDate=date, AttendancePeriod=3,
+                                      AttendanceDateTimeFrom=start)
+    with Synergetic.test() as session:
+        diff = sync_roll(session, master, [create_t_attendances(ID=51047, AttendedFlag=1),
+                                           create_t_attendances(ID=51048, AttendedFlag=0)])
+        session.commit()
+
+    :param session: A Synergetic session
+    :param master: The AttendanceMaster (or dict), e.g. from create_attendance_master. Its ROLL_KEY columns pick the
+    roll to sync
+    :param students: The tAttendances (or dicts) the roll should have, e.g. from create_t_attendances
+    :param delete_missing: Delete students on the existing roll that aren't in students
+    :param update_times: Also sync an existing master's AttendanceDateTimeFrom and AttendanceDateTimeTo, e.g. to
+    correct them
+    :return: RollDiff of the master's seq and the number of rows written
+    """
+    master_table = reflection.mapped('AttendanceMaster').__table__
+    student_table = reflection.mapped('tAttendances').__table__
+    students = list(students)
+    conn = session.connection()
+
+    query = select(*master_table.columns, *student_table.columns).select_from(
+        master_table.outerjoin(student_table,
+                               student_table.c.AttendanceMasterSeq == master_table.c.AttendanceMasterSeq)
+    ).where(
+        *[master_table.c[col] == _get(master, col) for col in ROLL_KEY]
+    ).order_by(master_table.c.AttendanceMasterSeq.desc())
+    existing_master = None
+    existing_students = {}
+    for row in conn.execute(query):
+        row_master = dict(zip(master_table.columns.keys(), row[:len(master_table.columns)]))
+        if existing_master is None:
+            existing_master = row_master
+        elif row_master['AttendanceMasterSeq'] != existing_master['AttendanceMasterSeq']:
+            break
+        student = dict(zip(student_table.columns.keys(), row[len(master_table.columns):]))
+        if student['AttendanceSeq'] is not None:
+            existing_students[student['ID']] = student
+
+    master_updated = 0
+    if existing_master is None:
+        columns = _columns_used(master_table, [master], exclude={'AttendanceMasterSeq'})
+        result = conn.execute(master_table.insert().values({col: _get(master, col) for col in columns}))
+        master_seq = result.inserted_primary_key[0]
+    else:
+        master_seq = existing_master['AttendanceMasterSeq']
+        exclude = set(ROLL_KEY) | {'AttendanceMasterSeq'} | (set() if update_times else _TIME_COLUMNS)
+        changes = _diff(master_table, master, existing_master, exclude=exclude)
+        if changes:
+            changes.pop('CreatedDate', None)
+            changes.pop('CreatedByID', None)
+            changes['AttendanceMasterSeq'] = master_seq
+            master_updated = update_many(conn, master_table, 'AttendanceMasterSeq', [changes])
+
+    inserts, updates, unchanged = [], [], 0
+    for student in students:
+        current = existing_students.pop(_get(student, 'ID'), None)
+        if current is None:
+            row = {col: _get(student, col) for col in _columns_used(student_table, [student],
+                                                                    exclude={'AttendanceSeq'})}
+            row['AttendanceMasterSeq'] = master_seq
+            inserts.append(row)
+            continue
+        changes = _diff(student_table, student, current, exclude={'AttendanceSeq', 'AttendanceMasterSeq', 'ID'})
+        if changes:
+            changes['AttendanceSeq'] = current['AttendanceSeq']
+            updates.append(changes)
+        else:
+            unchanged += 1
+    # Inserted per column set as executemany needs every row to have the same columns
+    groups = defaultdict(list)
+    for row in inserts:
+        groups[tuple(row)].append(row)
+    for rows in groups.values():
+        conn.execute(student_table.insert(), rows)
+    update_many(conn, student_table, 'AttendanceSeq', updates)
+    deleted = 0
+    if delete_missing and existing_students:
+        seqs = [student['AttendanceSeq'] for student in existing_students.values()]
+        conn.execute(student_table.delete().where(student_table.c.AttendanceSeq.in_(seqs)))
+        deleted = len(seqs)
+    return RollDiff(master_seq, master_updated, len(inserts), len(updates), deleted, unchanged)
+
+
+def update_many(conn, table, key, rows):
+    """
+    Updates many rows with one executemany UPDATE per set of columns changed
+
+    :param conn: Connection to run on, e.g. session.connection() to stay in the session's transaction
+    :param table: The Table to update
+    :param key: Name of the column identifying each row, e.g. 'AttendanceSeq'
+    :param rows: dicts of new values plus the key column
+    :return: Number of rows updated
+    """
+    groups = defaultdict(list)
+    for row in rows:
+        groups[tuple(sorted(col for col in row if col != key))].append(row)
+    for columns, group in groups.items():
+        statement = update(table).where(table.c[key] == bindparam(f'_{key}')).values(
+            {col: bindparam(f'_{col}') for col in columns})
+        conn.execute(statement, [{f'_{col}': value for col, value in row.items()} for row in group])
+    return len(rows)
+
+
+def _diff(table, desired, current, exclude):
+    """Columns set in desired that differ from current, with the audit columns too if anything else differs"""
+    changes = {}
+    for col in _columns_used(table, [desired], exclude=exclude):
+        value = _get(desired, col)
+        if not _same(value, current.get(col)):
+            changes[col] = value
+    if not set(changes) - _AUDIT_COLUMNS:
+        return {}
+    return changes
+
+
+def _same(a, b):
+    if isinstance(a, str) and isinstance(b, str):
+        return a.strip() == b.strip()
+    return a == b
+
+
+def _group_by_columns(table, numbered_rows, exclude):
+    """(number, row) pairs grouped by the columns each row gives a value"""
+    groups = defaultdict(list)
+    for number, row in numbered_rows:
+        groups[tuple(_columns_used(table, [row], exclude))].append((number, row))
+    return groups
+
+
+def _columns_used(table, rows, exclude):
+    """Columns given a value in any of the rows, so columns nobody set are left to their database defaults"""
+    used = set()
+    for row in rows:
+        used.update(col.name for col in table.columns if _get(row, col.name) is not None)
+    return [col.name for col in table.columns if col.name in used and col.name not in exclude]
+
+
+def _values(row, columns):
+    return [_get(row, col) for col in columns]
+
+
+def _get(row, col):
+    if isinstance(row, dict):
+        return row.get(col)
+    return getattr(row, col, None)
+
+
+def _create_staging(cursor, staging, table_name, columns):
+    # Copying the (empty) table keeps the staging column types in step with the real table
+    cols = ', '.join(f'[{col}]' for col in columns)
+    cursor.execute(f"SELECT TOP 0 {cols} INTO {staging} FROM [{table_name}]")
+    cursor.execute(f"ALTER TABLE {staging} ADD RollNumber int NOT NULL")
+
+
+def _stage(cursor, staging, columns, rows):
+    cols = ', '.join(['RollNumber'] + [f'[{col}]' for col in columns])
+    params = ', '.join('?' * (len(columns) + 1))
+    cursor.executemany(f"INSERT INTO {staging} ({cols}) VALUES ({params})", rows)
+
+
+def _drop_staging(cursor):
+    for staging in (_MASTER_STAGING, _STUDENT_STAGING, _SEQ_STAGING):
+        cursor.execute(f"IF OBJECT_ID('tempdb..{staging}') IS NOT NULL DROP TABLE {staging}")
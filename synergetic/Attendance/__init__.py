@@ -1 +1,4 @@
 from synergetic.Attendance.Attendance import create_attendance_master, create_t_attendances
+from synergetic.Attendance.Rolls import write_rolls, sync_roll
+from synergetic.Attendance.Extract import attendance_query, stream_attendance
+from synergetic.Attendance.Reconcile import reconcile, reconcile_day
@@ -0,0 +1,198 @@
+"""
+StaffSchedule clash detection.
+
+A ClashIndex holds the StaffSchedule lessons for a date range in memory, as a list sorted by start time for each staff
+member, room and location. A proposed lesson is checked with a binary search into each of its resources' lists, only
+looking back as far as that resource's longest lesson, so a week of generated schedules (or a relief allocation) is
+validated without a query per lesson. Lessons are added to (and removed from) the index as they're written.
+
+Example usage:
+index = ClashIndex.load(dt.date(2042, 3, 14), dt.date(2042, 3, 20))
+proposed = [create_staff_schedule(**lesson) for lesson in lessons]
+clashes = index.check(proposed)
+if not clashes:
+    with Synergetic.test() as session:
+        session.add_all(proposed)
+        session.flush()  # Gets their StaffScheduleSeq, which the index keys them by
+        index.add_many(proposed)
+        session.commit()
+
+Rows written without coming back as instances (e.g. the later occurrences from write_recurring_staff_schedules) have
+no StaffScheduleSeq to key them by, so load the range again afterwards instead.
+"""
+import bisect
+import datetime as dt
+from collections import namedtuple
+from collections.abc import Mapping
+
+from sqlalchemy.sql import select
+from synergetic import reflection
+from synergetic.convert import day_start, normalise
+import synergetic.synergetic_session as syn
+
+RESOURCES = ('StaffID', 'Room', 'LocationCode')
+
+# resource is the column the lessons share (e.g. 'Room') and value its value. schedule is the lesson checked and other
+# the one it clashes with: a StaffScheduleSeq for lessons in the index, or the position in the list passed to check
+Clash = namedtuple('Clash', 'resource value schedule other')
+Lesson = namedtuple('Lesson', 'start end key')
+
+
+class ClashIndex:
+    """
+    Lessons by resource, for clash checks
+
+    :param resources: Columns two lessons can't share at the same time
+    """
+
+    def __init__(self, resources=RESOURCES):
+        self.resources = tuple(resources)
+        self._lessons = {}  # (resource, value) -> list of Lesson sorted by start
+        self._starts = {}  # (resource, value) -> the lessons' starts, to bisect
+        self._longest = {}  # (resource, value) -> longest lesson, how far back a search has to look
+        self._keys = {}  # key -> (start, end, [(resource, value), ...]) to remove a lesson
+
+    @classmethod
+    def load(cls, date_from, date_to, resources=RESOURCES, engine=None):
+        """
+        Builds an index of the StaffSchedule lessons overlapping a date range, in one query
+
+        :param date_from: First date
+        :param date_to: Last date
+        :param resources: Columns two lessons can't share at the same time
+        :param engine: Name of the engine to read from, see synergetic_session.get_engine
+        :return: ClashIndex
+        """
+        index = cls(resources)
+        StaffSchedule = reflection.mapped('StaffSchedule').__table__
+        start = day_start(date_from)
+        end = day_start(date_to) + dt.timedelta(days=1)
+        query = select(
+            StaffSchedule.c.StaffScheduleSeq,
+            StaffSchedule.c.ScheduleDateTimeFrom,
+            StaffSchedule.c.ScheduleDateTimeTo,
+            *[StaffSchedule.c[resource] for resource in index.resources],
+        ).where(
+            StaffSchedule.c.ScheduleDateTimeFrom < end,
+            StaffSchedule.c.ScheduleDateTimeTo > start,
+        )
+        with syn.get_engine(engine).connect() as conn:
+            for row in conn.execute(query):
+                index.add(row._mapping)
+        return index
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def add(self, schedule, key=None):
+        """
+        Adds a lesson. Adding a key that's already in the index replaces it
+
+        :param schedule: A StaffSchedule (mapped instance, row or dict) with ScheduleDateTimeFrom/To and the resources
+        :param key: Identifies the lesson in clashes and for remove. Defaults to its StaffScheduleSeq
+        :return:
+        """
+        key = _get(schedule, 'StaffScheduleSeq') if key is None else key
+        if key is None:
+            raise ValueError("The lesson has no StaffScheduleSeq, pass a key to identify it")
+        if key in self._keys:
+            self.remove(key)
+        start, end = _times(schedule)
+        resources = self._resources(schedule)
+        for resource_value in resources:
+            starts = self._starts.setdefault(resource_value, [])
+            i = bisect.bisect_right(starts, start)
+            starts.insert(i, start)
+            self._lessons.setdefault(resource_value, []).insert(i, Lesson(start, end, key))
+            self._longest[resource_value] = max(self._longest.get(resource_value, dt.timedelta(0)), end - start)
+        self._keys[key] = (start, end, resources)
+
+    def add_many(self, schedules):
+        """Adds lessons keyed by their StaffScheduleSeq, e.g. after they've been written"""
+        for schedule in schedules:
+            self.add(schedule)
+
+    def remove(self, key):
+        """Removes a lesson, e.g. one that's been deleted or moved"""
+        start, end, resources = self._keys.pop(key)
+        for resource_value in resources:
+            lessons, starts = self._lessons[resource_value], self._starts[resource_value]
+            i = bisect.bisect_left(starts, start)
+            while i < len(lessons) and starts[i] == start:
+                if lessons[i].key == key:
+                    del lessons[i]
+                    del starts[i]
+                    break
+                i += 1
+
+    def clashes(self, schedule, ignore=()):
+        """
+        The lessons in the index a lesson clashes with
+
+        :param schedule: A StaffSchedule (mapped instance, row or dict)
+        :param ignore: Keys not to report, e.g. the lesson itself when it's already in the index
+        :return: List of Clash
+        """
+        start, end = _times(schedule)
+        clashes = []
+        for resource, value in self._resources(schedule):
+            for lesson in self._overlapping((resource, value), start, end):
+                if lesson.key not in ignore:
+                    clashes.append(Clash(resource, value, schedule, lesson.key))
+        return clashes
+
+    def check(self, schedules):
+        """
+        Checks many proposed lessons at once, against the index and against each other
+
+        :param schedules: List of StaffSchedules (mapped instances, rows or dicts)
+        :return: List of Clash. Clashes between two proposed lessons are reported once, on the later of the two in
+        schedules, with other as the position of the earlier one
+        """
+        proposed = ClashIndex(self.resources)
+        clashes = []
+        for position, schedule in enumerate(schedules):
+            clashes += self.clashes(schedule)
+            clashes += proposed.clashes(schedule)
+            proposed.add(schedule, key=position)
+        return clashes
+
+    def _overlapping(self, resource_value, start, end):
+        lessons = self._lessons.get(resource_value)
+        if not lessons:
+            return
+        # Lessons starting at or after end can't overlap, and nor can any starting before start - the longest lesson
+        i = bisect.bisect_left(self._starts[resource_value], end)
+        earliest = start - self._longest[resource_value]
+        while i > 0:
+            i -= 1
+            lesson = lessons[i]
+            if lesson.start <= earliest:
+                break
+            if lesson.end > start:
+                yield lesson
+
+    def _resources(self, schedule):
+        # Blank resources (no room, no location, StaffID 0) can't clash
+        return [(resource, value) for resource in self.resources
+                for value in [normalise(_get(schedule, resource))] if value not in (None, '', 0)]
+
+
+def _times(schedule):
+    start, end = _get(schedule, 'ScheduleDateTimeFrom'), _get(schedule, 'ScheduleDateTimeTo')
+    if start is None or end is None:
+        raise ValueError("A lesson needs ScheduleDateTimeFrom and ScheduleDateTimeTo to check for clashes")
+    return _as_datetime(start), _as_datetime(end)
+
+
+def _get(schedule, column):
+    if isinstance(schedule, Mapping):
+        return schedule.get(column)
+    return getattr(schedule, column, None)
+
+
+def _as_datetime(value):
+    return dt.datetime.fromisoformat(value) if isinstance(value, str) else value
@@ -0,0 +1,127 @@
+"""
+Recurring StaffSchedule lessons.
+
+Recurring lessons (instrumental, training) are stored as one StaffSchedule row per lesson, with every lesson after
+the first linked to the first through ParentStaffScheduleSeq. A Recurrence describes when the lessons happen and
+write_recurring_staff_schedules expands it into every occurrence and inserts them in bulk: one flush for the parents,
+then a single executemany for all of the children.
+"""
+import datetime as dt
+
+from sqlalchemy import insert
+from synergetic import reflection
+from synergetic.Schedule.Schedule import create_staff_schedule
+
+
+class Recurrence:
+    """
+    When a recurring lesson happens.
+
+    Example usage (every Tuesday and Thursday of term at 3:30pm for 30 minutes, except a public holiday):
+    Recurrence(dt.date(2042, 2, 1), dt.date(2042, 4, 8), dt.time(15, 30), duration=dt.timedelta(minutes=30),
+               weekdays={1, 3}, exclude={dt.date(2042, 3, 14)})
+
+    Or on days 2 and 7 of a 10 day timetable cycle, where cycle maps each school date to its day number:
+    Recurrence(dt.date(2042, 2, 1), dt.date(2042, 4, 8), dt.time(9, 0), cycle=cycle, cycle_days={2, 7})
+    """
+
+    def __init__(self, date_from, date_to, start_time, duration=dt.timedelta(minutes=60), weekdays=None,
+                 every_weeks=1, cycle=None, cycle_days=None, exclude=()):
+        """
+        :param date_from: First date lessons can happen (e.g. the start of term)
+        :param date_to: Last date lessons can happen
+        :param start_time: Time each lesson starts
+        :param duration: Length of each lesson
+        :param weekdays: Days of the week (Monday is 0) lessons happen on. Defaults to the weekday of date_from
+        :param every_weeks: Only every n-th week from date_from, e.g. 2 for fortnightly
+        :param cycle: dict of date -> timetable cycle day number. When given, lessons follow cycle_days instead of
+        weekdays
+        :param cycle_days: Cycle day numbers lessons happen on
+        :param exclude: Dates with no lesson (e.g. public holidays, camps)
+        """
+        self.date_from = date_from
+        self.date_to = date_to
+        self.start_time = start_time
+        self.duration = duration
+        self.weekdays = set(weekdays) if weekdays is not None else {date_from.weekday()}
+        self.every_weeks = every_weeks
+        self.cycle = cycle
+        self.cycle_days = set(cycle_days or ())
+        self.exclude = set(exclude)
+
+    def dates(self):
+        """Every date a lesson happens on, in order"""
+        days = (self.date_to - self.date_from).days + 1
+        candidates = (self.date_from + dt.timedelta(days=i) for i in range(max(days, 0)))
+        if self.cycle is not None:
+            return [date for date in candidates
+                    if self.cycle.get(date) in self.cycle_days and date not in self.exclude]
+        week_start = self.date_from - dt.timedelta(days=self.date_from.weekday())
+        return [date for date in candidates
+                if date.weekday() in self.weekdays
+                and ((date - week_start).days // 7) % self.every_weeks == 0
+                and date not in self.exclude]
+
+    def occurrences(self):
+        """(start datetime, end datetime) of every lesson, in order"""
+        return [(start, start + self.duration)
+                for start in (dt.datetime.combine(date, self.start_time) for date in self.dates())]
+
+
+def write_recurring_staff_schedules(session, recurrence, schedules):
+    """
+    Expands a recurrence for many lessons (e.g. every student's music lesson) and inserts every occurrence. The first
+    occurrence of each lesson is the parent and the rest are linked to it through ParentStaffScheduleSeq. Runs inside
+    the session's transaction, so commit the session afterwards as usual.
+
+    Example usage:
+    with Synergetic.test() as session:
+        parents = write_recurring_staff_schedules(session, recurrence, [
+            {'StaffID': 51087, 'SubjectClassesSeq': 654321, 'StaffScheduleTypeCode': 'MUSIC'},
+            {'StaffID': 51087, 'SubjectClassesSeq': 654322, 'StaffScheduleTypeCode': 'MUSIC'},
+        ])
+        session.commit()
+
+    :param session: A Synergetic session
+    :param recurrence: Recurrence, or a list of them parallel to schedules
+    :param schedules: List of dicts of create_staff_schedule arguments, one per lesson. Schedule date and time
+    arguments are ignored, they come from the recurrence
+    :return: List of the parent StaffSchedules, parallel to schedules
+    """
+    StaffSchedule = reflection.mapped('StaffSchedule')
+    recurrences = recurrence if isinstance(recurrence, (list, tuple)) else [recurrence] * len(schedules)
+    columns = set(StaffSchedule.__table__.columns.keys()) - {'StaffScheduleSeq'}
+    parents = []
+    templates = []
+    for recurrence, schedule in zip(recurrences, schedules):
+        occurrences = recurrence.occurrences()
+        if not occurrences:
+            parents.append(None)
+            templates.append(None)
+            continue
+        schedule = {key: value for key, value in schedule.items() if not key.startswith('Schedule')}
+        start, end = occurrences[0]
+        parent = create_staff_schedule(ScheduleDateTimeFrom=start, ScheduleDateTimeTo=end, **schedule)
+        template = {key: value for key, value in vars(parent).items() if key in columns}
+        parents.append(parent)
+        templates.append((template, occurrences[1:]))
+    session.add_all([parent for parent in parents if parent is not None])
+    session.flush()  # Gets the parents' StaffScheduleSeq
+
+    rows = []
+    for parent, template in zip(parents, templates):
+        if parent is None:
+            continue
+        template, occurrences = template
+        for start, end in occurrences:
+            rows.append(dict(template,
+                             ParentStaffScheduleSeq=parent.StaffScheduleSeq,
+                             ScheduleDateTimeFrom=start,
+                             ScheduleDateTimeTo=end,
+                             ScheduleDateFrom=start.date(),
+                             ScheduleTimeFrom=start.time(),
+                             ScheduleDateTo=end.date(),
+                             ScheduleTimeTo=end.time()))
+    if rows:
+        session.execute(insert(StaffSchedule.__table__), rows)
+    return parents
@@ -1,38 +1,43 @@
-from sqlalchemy.ext.automap import automap_base
-from sqlalchemy import create_engine, MetaData
 from sqlalchemy.sql import select
-from synergetic.School import CURRENT_YEAR, CURRENT_SEMESTER
-from synergetic.School import SubjectClasses
+from synergetic import reflection
+from sqlalchemy import insert, lambda_stmt
+from synergetic.School import Subjects, school
 from synergetic.synergetic_session import Synergetic
-from sqlalchemy.orm import relationship
 import datetime as dt
+from collections import defaultdict
 import synergetic.errors as errors
-import synergetic.synergetic_session as syn
 
-syn.metadata.reflect(syn.engine,
-                     only=['StaffSchedule', 'StaffScheduleStudentClasses'])
 
-Base = automap_base(metadata=syn.metadata)
-
-
-class StaffSchedule(Base):
-    __tablename__ = 'SubjectClasses'
+class _StaffSchedule:
+    """
+    Lookups added to the mapped StaffSchedule class. The query is a lambda statement, so it's built and compiled once.
+    Pass rows=True to get a read-only namedtuple (see reflection.row_class) instead of a mapped instance, and engine to
+    look up on a named engine other than synergetic_session.DEFAULT_ENGINE.
+    """
 
     @classmethod
-    def from_subject_class_seq_date_from(cls, subject_class_seq, date_time_from):
-        query = select(StaffSchedule).filter_by(SubjectClassesSeq=subject_class_seq, DateFrom=date_time_from)
-        with Synergetic.test() as session:
-            subject_class = session.execute(query).scalars().all()
+    def from_subject_class_seq_date_from(cls, subject_class_seq, date_time_from, rows=False, engine=None):
+        table = cls.__table__
+        query = lambda_stmt(lambda: select(table)) if rows else lambda_stmt(lambda: select(cls))
+        query += lambda query: query.where(table.c.SubjectClassesSeq == subject_class_seq,
+                                           table.c.ScheduleDateTimeFrom == date_time_from)
+        with Synergetic.named(engine) as session:
+            if rows:
+                row_class = reflection.row_class('StaffSchedule')
+                subject_class = [row_class._make(row) for row in session.connection().execute(query)]
+            else:
+                subject_class = session.execute(query).scalars().all()
         if len(subject_class) != 1:
             raise errors.LookUpError(f"Database lookup return {len(subject_class)} results, when 1 was expected"
                                      f"\n{locals()=}")
         return subject_class[0]
 
 
-Base.prepare()
-
+# Only deal with these tables. They're reflected on first use, see synergetic.reflection
+reflection.register('StaffSchedule', _StaffSchedule)
+reflection.register('StaffScheduleStudentClasses')
 
-StaffScheduleStudentClasses = Base.classes.StaffScheduleStudentClasses
+__getattr__ = reflection.module_getattr(__name__, 'StaffSchedule', 'StaffScheduleStudentClasses')
 
 
 def create_staff_schedule(StaffID=0,
@@ -134,7 +139,7 @@ def create_staff_schedule(StaffID=0,
         'SystemProcessNumber': SystemProcessNumber
     }
     args = {key: value for key, value in args.items() if value is not None}
-    return StaffSchedule(**args)
+    return reflection.mapped('StaffSchedule')(**args)
 
 
 def create_staff_schedule_student_classes(StaffScheduleSeq=None, FileType='A',
@@ -180,14 +185,75 @@ def create_staff_schedule_student_classes(StaffScheduleSeq=None, FileType='A',
         raise errors.MissingValueError("ClassCode is required to create a StaffScheduleStudentClasses instance but is "
                                        "missing.")
     if SubjectClassesSeq is None:
-        sc = SubjectClasses.from_class_code_query(ClassCode, filetype=FileType, fileyear=FileYear,
-                                                  filesemester=FileSemester, classcampus=FileSemester)
+        sc = Subjects.SubjectClasses.from_class_code(ClassCode, filetype=FileType, fileyear=FileYear,
+                                                     filesemester=FileSemester, classcampus=ClassCampus)
         SubjectClassesSeq = sc.SubjectClassesSeq
+        FileYear = sc.FileYear
+        FileSemester = sc.FileSemester
     if AttendedFlag is None:
         AttendedFlag = 1
     vars = {'StaffScheduleSeq', 'FileType', 'FileYear', 'FileSemester', 'ClassCampus', 'ClassCode', 'ID',
             'AttendedFlag', 'SubjectClassesSeq', 'ConfirmedDateTime', 'ConfirmedByUser', 'PossibleAbsenceCode',
             'PossibleReasonCode', 'PossibleDescription'}
     args = {key: value for key, value in locals().items() if key in vars and value is not None}
-    return StaffScheduleStudentClasses(**args)
+    return reflection.mapped('StaffScheduleStudentClasses')(**args)
+
+
+def write_staff_schedule_rosters(session, rosters, engine=None, **defaults):
+    """
+    Creates the StaffScheduleStudentClasses for whole rosters at once. Each distinct class is resolved once (cached
+    classes aren't looked up at all), every row is built in memory and they're inserted with a single executemany.
+    Runs inside the session's transaction, so commit the session afterwards as usual.
+
+    Example usage (an excursion):
+    with Synergetic.test() as session:
+        write_staff_schedule_rosters(session,
+                                     [(123456, [{'ID': 51047, 'ClassCode': '13FUN01'},
+                                                {'ID': 51048, 'ClassCode': '13FUN02'}])],
+                                     FileType='SS', AttendedFlag=0, PossibleAbsenceCode='EXCUR')
+        session.commit()
+
+    :param session: A Synergetic session
+    :param rosters: Iterable of (StaffSchedule or StaffScheduleSeq, roster) pairs. A roster is a list of dicts of
+    create_staff_schedule_student_classes arguments, one per student, with at least ID and ClassCode
+    :param engine: Name of the engine the classes are looked up on, i.e. the session's, see
+    synergetic_session.get_engine
+    :param defaults: create_staff_schedule_student_classes arguments for every student, unless their dict overrides it
+    :return: Number of rows inserted
+    """
+    table = reflection.mapped('StaffScheduleStudentClasses').__table__
+    students = []
+    for staff_schedule, roster in rosters:
+        staff_schedule_seq = getattr(staff_schedule, 'StaffScheduleSeq', staff_schedule)
+        for student in roster:
+            students.append(dict(defaults, StaffScheduleSeq=staff_schedule_seq, **student))
+
+    # Resolve each distinct class once
+    keys = {}
+    for student in students:
+        if student.get('SubjectClassesSeq') is None and student.get('ClassCode') is not None:
+            student.setdefault('FileType', 'A')
+            student.setdefault('ClassCampus', 'S')
+            if student.get('FileYear') is None:
+                student['FileYear'] = school.current_term(engine).FileYear
+            if student.get('FileSemester') is None:
+                student['FileSemester'] = school.current_term(engine).FileSemester
+            key = (student['ClassCode'], student['FileType'], student['FileYear'], student['FileSemester'],
+                   student['ClassCampus'])
+            keys[id(student)] = key
+    subject_classes = Subjects.SubjectClasses.from_class_codes(set(keys.values()), engine=engine)
 
+    rows = []
+    for student in students:
+        if id(student) in keys:
+            student['SubjectClassesSeq'] = subject_classes[keys[id(student)]].SubjectClassesSeq
+        row = create_staff_schedule_student_classes(**student)
+        rows.append({col.name: getattr(row, col.name, None) for col in table.columns if col.name in vars(row)})
+    # Inserted per column set as executemany needs every row to have the same columns, and padding a row with NULLs
+    # would skip the defaults of the columns it didn't set
+    groups = defaultdict(list)
+    for row in rows:
+        groups[frozenset(row)].append(row)
+    for group in groups.values():
+        session.execute(insert(table), group)
+    return len(rows)
@@ -0,0 +1,10 @@
+from synergetic.Schedule.Schedule import create_staff_schedule, create_staff_schedule_student_classes, \
+    write_staff_schedule_rosters
+from synergetic.Schedule.Recurring import Recurrence, write_recurring_staff_schedules
+from synergetic.Schedule.Clashes import ClashIndex
+from synergetic.Schedule import Schedule
+
+
+def __getattr__(name):
+    # synergetic.Schedule used to be the Schedule module, so its names (e.g. StaffSchedule) still resolve here
+    return getattr(Schedule, name)
@@ -1,42 +1,185 @@
-from sqlalchemy.ext.automap import automap_base
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import lambda_stmt
 from sqlalchemy.sql import select
-from sqlalchemy.orm import relationship
+from synergetic import reflection
+from synergetic.cache import LRUCache
 from synergetic.synergetic_session import Synergetic
-from synergetic.School import CURRENT_YEAR, CURRENT_SEMESTER
+from synergetic.School import school
 import synergetic.errors as errors
 import synergetic.synergetic_session as syn
 
+# SQL Server allows at most 2100 parameters per statement
+CHUNK_SIZE = 1000
 
-# Only deal with these tables
-syn.metadata.reflect(syn.engine, only=['SubjectClasses'])
+# Resolved classes, keyed by ('seq', SubjectClassesSeq, rows, engine) and by ('code', (ClassCode, FileType, FileYear,
+# FileSemester, ClassCampus), rows, engine), where rows is whether it's a read-only row rather than a mapped instance
+# and engine is the name of the engine it was read from. Both keys point to the same instance
+_cache = LRUCache(maxsize=8192)
 
-Base = automap_base(metadata=syn.metadata)
 
+def _class_key(subject_class):
+    return (subject_class.ClassCode, subject_class.FileType, subject_class.FileYear, subject_class.FileSemester,
+            subject_class.ClassCampus)
 
-class SubjectClasses(Base):
-    __tablename__ = 'SubjectClasses'
+
+def _chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _select(cls, rows):
+    """The lambda statement each lookup adds its criteria to, selecting the table's columns or the mapped class"""
+    table = cls.__table__
+    return lambda_stmt(lambda: select(table)) if rows else lambda_stmt(lambda: select(cls))
+
+
+def _execute(session, query, rows):
+    """
+    Runs a lookup query, either through the ORM (mapped instances) or on the session's connection, returning read-only
+    namedtuples that skip the identity map and instance state
+    """
+    if not rows:
+        return session.execute(query).scalars()
+    row_class = reflection.row_class('SubjectClasses')
+    return [row_class._make(row) for row in session.connection().execute(query)]
+
+
+class _SubjectClasses:
+    """
+    Lookups added to the mapped SubjectClasses class
+
+    The queries are lambda statements, so each one is built and compiled once and later calls only bind new values.
+    Pass rows=True to get read-only namedtuples (see reflection.row_class) instead of mapped instances, which are much
+    cheaper to build in tight loops. engine is the name of the engine to look up on, defaulting to
+    synergetic_session.DEFAULT_ENGINE.
+    """
+
+    @classmethod
+    def from_seq(cls, seq, rows=False, engine=None):
+        return cls.from_seqs([seq], rows=rows, engine=engine)[seq]
 
     @classmethod
-    def from_seq(cls, seq):
-        query = select(SubjectClasses).filter_by(SubjectClassesSeq=seq)
-        with Synergetic.test() as session:
-            subject_class = session.execute(query).scalars().all()
-        if len(subject_class) != 1:
-            raise errors.LookUpError(f"Database lookup return {len(subject_class)} results, when 1 was expected"
-                                     f"\n{seq=}")
-        return subject_class[0]
+    def from_class_code(cls, classcode, filetype='A', fileyear=None, filesemester=None, classcampus='S', rows=False,
+                        engine=None):
+        if fileyear is None:
+            fileyear = school.current_term(engine).FileYear
+        if filesemester is None:
+            filesemester = school.current_term(engine).FileSemester
+        key = (classcode, filetype, fileyear, filesemester, classcampus)
+        return cls.from_class_codes([key], rows=rows, engine=engine)[key]
 
     @classmethod
-    def from_class_code(cls, classcode, filetype='A', fileyear=CURRENT_YEAR, filesemester=CURRENT_SEMESTER, classcampus='S'):
-        query = select(SubjectClasses).filter_by(ClassCode=classcode, FileType=filetype, FileYear=fileyear,
-                                                 FileSemester=filesemester, ClassCampus=classcampus)
-        with Synergetic.test() as session:
-            subject_class = session.execute(query).scalars().all()
-        if len(subject_class) != 1:
-            raise errors.LookUpError(f"Database lookup return {len(subject_class)} results, when 1 was expected"
-                                     f"\n{locals()=}")
-        return subject_class[0]
-
-
-Base.prepare()
+    def from_seqs(cls, seqs, strict=True, rows=False, engine=None):
+        """
+        Resolves many SubjectClassesSeqs at once. Cached classes are returned without going to the server, the rest are
+        fetched in chunked IN queries over a single session.
+
+        :param seqs: Iterable of SubjectClassesSeq
+        :param strict: Raise a LookUpError if any seq can't be found, otherwise they're left out of the result
+        :param rows: Return read-only namedtuples instead of mapped instances
+        :param engine: Name of the engine to look up on, see synergetic_session.get_engine
+        :return: dict of SubjectClassesSeq -> SubjectClasses
+        """
+        engine = syn.DEFAULT_ENGINE if engine is None else engine
+        found = {}
+        missing = []
+        for seq in set(seqs):
+            subject_class = _cache.get(('seq', seq, rows, engine))
+            if subject_class is None:
+                missing.append(seq)
+            else:
+                found[seq] = subject_class
+        if missing:
+            table = cls.__table__
+            with Synergetic.named(engine) as session:
+                for chunk in _chunks(missing):
+                    query = _select(cls, rows) + (lambda query: query.where(table.c.SubjectClassesSeq.in_(chunk)))
+                    for subject_class in _execute(session, query, rows):
+                        _cache_class(subject_class, rows, engine)
+                        found[subject_class.SubjectClassesSeq] = subject_class
+        not_found = [seq for seq in missing if seq not in found]
+        if strict and not_found:
+            raise errors.LookUpError(f"Database lookup returned no results for {len(not_found)} SubjectClassesSeq"
+                                     f"\n{not_found=}")
+        return found
+
+    @classmethod
+    def from_class_codes(cls, keys, strict=True, rows=False, engine=None):
+        """
+        Resolves many classes at once. Cached classes are returned without going to the server, the rest are fetched
+        with one chunked ClassCode IN query per (FileType, FileYear, FileSemester, ClassCampus) over a single session.
+
+        Example usage:
+        SubjectClasses.from_class_codes([('10ENG01', 'A', 2022, 1, 'S'), ('10MAT02', 'A', 2022, 1, 'S')])
+
+        :param keys: Iterable of (ClassCode, FileType, FileYear, FileSemester, ClassCampus) tuples
+        :param strict: Raise a LookUpError if any key doesn't resolve to exactly one class, otherwise unresolved keys
+        are left out of the result
+        :param rows: Return read-only namedtuples instead of mapped instances
+        :param engine: Name of the engine to look up on, see synergetic_session.get_engine
+        :return: dict of key -> SubjectClasses
+        """
+        engine = syn.DEFAULT_ENGINE if engine is None else engine
+        found = {}
+        missing = {}
+        for key in set(map(tuple, keys)):
+            subject_class = _cache.get(('code', key, rows, engine))
+            if subject_class is None:
+                classcode, *group = key
+                missing.setdefault(tuple(group), []).append(classcode)
+            else:
+                found[key] = subject_class
+        duplicates = set()
+        if missing:
+            table = cls.__table__
+            with Synergetic.named(engine) as session:
+                for (filetype, fileyear, filesemester, classcampus), classcodes in missing.items():
+                    for chunk in _chunks(classcodes):
+                        query = _select(cls, rows) + (lambda query: query.where(
+                            table.c.ClassCode.in_(chunk), table.c.FileType == filetype, table.c.FileYear == fileyear,
+                            table.c.FileSemester == filesemester, table.c.ClassCampus == classcampus))
+                        for subject_class in _execute(session, query, rows):
+                            key = _class_key(subject_class)
+                            if key in found:
+                                duplicates.add(key)
+                            found[key] = subject_class
+        for key in duplicates:
+            del found[key]
+        for key, subject_class in found.items():
+            _cache_class(subject_class, rows, engine)
+        requested = [(classcode, *group) for group, classcodes in missing.items() for classcode in classcodes]
+        not_found = [key for key in requested if key not in found]
+        if strict and not_found:
+            raise errors.LookUpError(f"Database lookup didn't return exactly 1 result for {len(not_found)} classes"
+                                     f"\n{not_found=}")
+        return found
+
+
+def _cache_class(subject_class, rows, engine):
+    _cache.put(('seq', subject_class.SubjectClassesSeq, rows, engine), subject_class)
+    _cache.put(('code', _class_key(subject_class), rows, engine), subject_class)
+
+
+def invalidate_cache(seqs=None, engine=None):
+    """
+    Drops resolved classes from the lookup cache so the next lookup goes back to the server
+
+    :param seqs: SubjectClassesSeqs to drop. Clears the whole cache (for every engine) when None
+    :param engine: Name of the engine the seqs were read from, see synergetic_session.get_engine
+    :return:
+    """
+    if seqs is None:
+        _cache.clear()
+        return
+    engine = syn.DEFAULT_ENGINE if engine is None else engine
+    for seq in seqs:
+        for rows in (False, True):
+            subject_class = _cache.pop(('seq', seq, rows, engine))
+            if subject_class is not None:
+                _cache.pop(('code', _class_key(subject_class), rows, engine))
+
+
+# Only deal with these tables. They're reflected on first use, see synergetic.reflection
+reflection.register('SubjectClasses', _SubjectClasses)
+
+__getattr__ = reflection.module_getattr(__name__, 'SubjectClasses')
@@ -1,2 +1,10 @@
-from synergetic.School.school import FileSemesters, CURRENT_YEAR, CURRENT_SEMESTER
-from synergetic.School.Subjects import SubjectClasses
+from synergetic.School import school, Subjects
+
+
+def __getattr__(name):
+    # Resolved lazily so importing synergetic.School doesn't reflect anything
+    if name in ('FileSemesters', 'CURRENT_YEAR', 'CURRENT_SEMESTER'):
+        return getattr(school, name)
+    if name == 'SubjectClasses':
+        return Subjects.SubjectClasses
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,26 +1,128 @@
-from sqlalchemy.ext.automap import automap_base
-from sqlalchemy import create_engine, MetaData
+"""
+The school calendar.
+
+FileSemesters is read whole in one query and kept for TTL seconds, so the current semester (the one with
+SystemCurrentFlag set) follows a rollover in a long running worker, and term dates are looked up without a query.
+
+Example usage:
+calendar().current()  # (2022, 1)
+calendar().semester_for(dt.date(2022, 3, 14)).Description
+calendar().refresh()  # e.g. straight after rolling the semester over
+"""
+import threading
+import time
+from collections import namedtuple
+
 from sqlalchemy.sql import select
+from synergetic import reflection
+from synergetic.convert import as_date
+import synergetic.errors as errors
 import synergetic.synergetic_session as syn
 
+# Seconds before FileSemesters is read again
+TTL = 600
+
+Term = namedtuple('Term', 'FileYear FileSemester')
+
+
+class TermCalendar:
+    """
+    FileSemesters cached as a list of rows (see reflection.row_class) ordered by FileYear and FileSemester
+
+    :param engine: Name of the engine to read from, see synergetic_session.get_engine
+    :param ttl: Seconds before the table is read again
+    """
+
+    def __init__(self, engine=None, ttl=TTL):
+        self.engine = engine
+        self.ttl = ttl
+        self._semesters = None
+        self._current = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def semesters(self):
+        """Every semester, reading the table again if it's older than ttl"""
+        with self._lock:
+            if self._semesters is None or time.monotonic() - self._loaded_at > self.ttl:
+                self._semesters, self._current = self._load()
+                self._loaded_at = time.monotonic()
+            return self._semesters
+
+    def refresh(self):
+        """Reads the table again on next use"""
+        with self._lock:
+            self._semesters = None
+
+    def current(self):
+        """Term(FileYear, FileSemester) of the semester with SystemCurrentFlag set"""
+        self.semesters()
+        if self._current is None:
+            raise errors.LookUpError("No FileSemesters row has SystemCurrentFlag set")
+        return self._current
+
+    def get(self, fileyear, filesemester, default=None):
+        """The FileSemesters row for a semester"""
+        for semester in self.semesters():
+            if (semester.FileYear, semester.FileSemester) == (fileyear, filesemester):
+                return semester
+        return default
+
+    def semester_for(self, date, default=None):
+        """The FileSemesters row whose StartDate to EndDate includes date"""
+        date = as_date(date)
+        for semester in self.semesters():
+            if semester.StartDate is not None and semester.EndDate is not None \
+                    and as_date(semester.StartDate) <= date <= as_date(semester.EndDate):
+                return semester
+        return default
+
+    def _load(self):
+        FileSemesters = reflection.mapped('FileSemesters').__table__
+        row_class = reflection.row_class('FileSemesters')
+        with syn.get_engine(self.engine).connect() as conn:
+            semesters = [row_class._make(row) for row in conn.execute(
+                select(FileSemesters).order_by(FileSemesters.c.FileYear, FileSemesters.c.FileSemester))]
+        current = [Term(semester.FileYear, semester.FileSemester) for semester in semesters
+                   if semester.SystemCurrentFlag == 1]
+        return semesters, current[0] if current else None
+
+
+_calendars = {}
+_calendars_lock = threading.Lock()
+
+
+def calendar(engine=None):
+    """
+    The TermCalendar for an engine, shared by everything in the process
+
+    :param engine: Name of the engine, defaults to synergetic_session.DEFAULT_ENGINE
+    :return: TermCalendar
+    """
+    name = syn.DEFAULT_ENGINE if engine is None else engine
+    term_calendar = _calendars.get(name)
+    if term_calendar is None:
+        with _calendars_lock:
+            term_calendar = _calendars.setdefault(name, TermCalendar(name))
+    return term_calendar
 
-# Only deal with these tables
-syn.metadata.reflect(syn.engine, only=['FileSemesters'])
 
-Base = automap_base(metadata=syn.metadata)
-Base.prepare()
+def current_term(engine=None):
+    """Term(FileYear, FileSemester) of the current semester, see TermCalendar.current"""
+    return calendar(engine).current()
 
-FileSemesters = Base.classes.FileSemesters
 
-_res = [row for row in syn.engine.execute(
-    select(
-        FileSemesters.FileYear,
-        FileSemesters.FileSemester
-    ).where(
-        FileSemesters.SystemCurrentFlag == 1
-    )
-)]
+# Only deal with these tables. They're reflected on first use, see synergetic.reflection
+reflection.register('FileSemesters')
 
-CURRENT_YEAR, CURRENT_SEMESTER = _res[0]
+_mapped_getattr = reflection.module_getattr(__name__, 'FileSemesters')
 
 
+def __getattr__(name):
+    # CURRENT_YEAR and CURRENT_SEMESTER are kept for existing code. They're resolved from the calendar on every
+    # access, so they follow a rollover
+    if name == 'CURRENT_YEAR':
+        return current_term().FileYear
+    if name == 'CURRENT_SEMESTER':
+        return current_term().FileSemester
+    return _mapped_getattr(name)
@@ -1,5 +1,5 @@
 from synergetic.synergetic_session import Synergetic
 from synergetic.School import school
 from synergetic.Attendance import Attendance
-from synergetic.Schedule import Schedule
+from synergetic import Schedule  # The package, so its submodules can be imported through it
 
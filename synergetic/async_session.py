@@ -0,0 +1,146 @@
+"""
+asyncio facade for the lookups and roll writes.
+
+Everything in synergetic blocks (pyodbc has no async driver), so AsyncSynergetic runs each call on its own thread pool,
+sized to the engine's connection pool so an async app can't queue more concurrent queries than the pool (and the
+server) is set up for. Calls are awaited with an optional timeout. Cancelling a call (or timing out) drops it if it
+hasn't started, and rolls its session back instead of committing if it has.
+
+Example usage:
+async with AsyncSynergetic(timeout=10) as db:
+    subject_class = await db.subject_class_from_class_code('10ENG01')
+    seqs = await db.write_rolls(rolls)
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from synergetic.Attendance import Attendance, Rolls
+from synergetic.School import Subjects
+from synergetic.Schedule import Schedule
+from synergetic.Schedule.Recurring import write_recurring_staff_schedules
+import synergetic.synergetic_session as syn
+from synergetic.synergetic_session import Synergetic
+
+
+class AsyncSynergetic:
+    """
+    Runs synergetic calls on a bounded thread pool
+
+    :param engine: Name of the engine the lookups and writes use, see synergetic_session.get_engine
+    :param max_workers: Calls run at once. Defaults to the engine's pool_size, so each call can hold a pooled connection
+    :param timeout: Default seconds to wait for each call, None to wait forever
+    """
+
+    def __init__(self, engine=None, max_workers=None, timeout=None):
+        self.engine = engine
+        self.timeout = timeout
+        if max_workers is None:
+            max_workers = syn.pool_size(engine)
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='synergetic')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Stops the thread pool. Calls that haven't started are cancelled, running ones finish in the background"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn, *args, timeout=None, **kwargs):
+        """
+        Awaits fn(*args, **kwargs) run on the thread pool
+
+        :param fn: Any blocking callable
+        :param timeout: Seconds to wait, defaults to the instance's timeout. asyncio.TimeoutError is raised after it
+        :return: What fn returns
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+        return await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+
+    async def run_in_session(self, fn, *args, timeout=None, **kwargs):
+        """
+        Awaits fn(session, *args, **kwargs) in a new session that's committed afterwards. If the call is cancelled or
+        times out before the commit, the session is rolled back instead.
+
+        :param fn: A callable taking a Synergetic session first, e.g. write_rolls
+        :param timeout: Seconds to wait, defaults to the instance's timeout
+        :return: What fn returns
+        """
+        cancelled = threading.Event()
+
+        def in_session():
+            with Synergetic.named(self.engine or syn.DEFAULT_ENGINE) as session:
+                # What fn returns (e.g. the parent StaffSchedules) is used after the session closes, so it's kept loaded
+                session.expire_on_commit = False
+                result = fn(session, *args, **kwargs)
+                if cancelled.is_set():
+                    session.rollback()
+                else:
+                    session.commit()
+                return result
+
+        try:
+            return await self.run(in_session, timeout=timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            cancelled.set()
+            raise
+
+    # Lookups
+
+    async def subject_class_from_seq(self, seq, timeout=None):
+        return await self.run(Subjects.SubjectClasses.from_seq, seq, engine=self.engine, timeout=timeout)
+
+    async def subject_class_from_class_code(self, classcode, filetype='A', fileyear=None, filesemester=None,
+                                            classcampus='S', timeout=None):
+        return await self.run(Subjects.SubjectClasses.from_class_code, classcode, filetype=filetype,
+                              fileyear=fileyear, filesemester=filesemester, classcampus=classcampus,
+                              engine=self.engine, timeout=timeout)
+
+    async def subject_classes_from_seqs(self, seqs, strict=True, timeout=None):
+        return await self.run(Subjects.SubjectClasses.from_seqs, list(seqs), strict=strict, engine=self.engine,
+                              timeout=timeout)
+
+    async def subject_classes_from_class_codes(self, keys, strict=True, timeout=None):
+        return await self.run(Subjects.SubjectClasses.from_class_codes, list(keys), strict=strict,
+                              engine=self.engine, timeout=timeout)
+
+    async def staff_schedule_from_subject_class_seq_date_from(self, subject_class_seq, date_time_from, timeout=None):
+        return await self.run(Schedule.StaffSchedule.from_subject_class_seq_date_from, subject_class_seq,
+                              date_time_from, engine=self.engine, timeout=timeout)
+
+    # Factories. They can query on first use (the current term, the lookup tables), so they run on the pool too
+
+    async def create_attendance_master(self, **kwargs):
+        return await self.run(Attendance.create_attendance_master, **kwargs)
+
+    async def create_t_attendances(self, **kwargs):
+        return await self.run(Attendance.create_t_attendances, **kwargs)
+
+    async def create_absence_events(self, **kwargs):
+        return await self.run(Attendance.create_absence_events, **kwargs)
+
+    async def create_staff_schedule(self, **kwargs):
+        return await self.run(Schedule.create_staff_schedule, **kwargs)
+
+    # Writes, each in its own committed session
+
+    async def write_rolls(self, rolls, timeout=None):
+        return await self.run_in_session(Rolls.write_rolls, list(rolls), timeout=timeout)
+
+    async def sync_roll(self, master, students, delete_missing=False, update_times=False, timeout=None):
+        return await self.run_in_session(Rolls.sync_roll, master, list(students), delete_missing=delete_missing,
+                                         update_times=update_times, timeout=timeout)
+
+    async def write_staff_schedule_rosters(self, rosters, timeout=None, **defaults):
+        return await self.run_in_session(Schedule.write_staff_schedule_rosters, list(rosters), engine=self.engine,
+                                         timeout=timeout, **defaults)
+
+    async def write_recurring_staff_schedules(self, recurrence, schedules, timeout=None):
+        return await self.run_in_session(write_recurring_staff_schedules, recurrence, list(schedules),
+                                         timeout=timeout)
@@ -0,0 +1,132 @@
+"""
+Attendance change feed.
+
+A ChangeFeed polls AttendanceMaster, tAttendances and AbsenceEvents for rows modified after its watermarks (the last
+ModifiedDate and seq seen per table) and emits each change once, so downstream systems (notifications, the LMS) only
+ever read changed rows instead of re-reading the day. Rows are often inserted without a ModifiedDate, so each poll
+first reads the rows with a seq past the highest seen, whatever their ModifiedDate, as inserts.
+
+Example usage:
+feed = ChangeFeed(tables=['tAttendances'], poll_interval=10)
+for change in feed:
+    if change.kind == 'update' and not change.row['AttendedFlag']:
+        notify_parents(change.row['ID'])
+
+Or from async code:
+async for change in ChangeFeed():
+    ...
+"""
+import asyncio
+import time
+from collections import namedtuple
+
+from sqlalchemy import func, select
+from synergetic import reflection
+from synergetic.cache import LRUCache
+from synergetic.mirror import MIRROR_TABLES, changes_query, new_rows_query
+import synergetic.synergetic_session as syn
+
+# kind is 'insert' for a seq the feed hasn't passed yet, otherwise 'update'
+Change = namedtuple('Change', 'table kind seq modified row')
+
+BATCH_SIZE = 1000
+POLL_INTERVAL = 5.0
+
+
+class ChangeFeed:
+    """
+    Polls for changed attendance rows
+
+    :param tables: Tables to watch. Defaults to every table in mirror.MIRROR_TABLES
+    :param engine: Name of the engine to poll, see synergetic_session.get_engine
+    :param batch_size: Rows read per query. A poll keeps reading batches until it's caught up
+    :param poll_interval: Seconds to wait between polls that found nothing, when iterating
+    :param checkpoint: A saved feed.checkpoint() to resume from. Tables without one start from the current latest
+    change, so only new changes are emitted
+    """
+
+    def __init__(self, tables=None, engine=None, batch_size=BATCH_SIZE, poll_interval=POLL_INTERVAL,
+                 checkpoint=None):
+        self.tables = list(tables or MIRROR_TABLES)
+        self.engine = engine
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        checkpoint = checkpoint or {}
+        self.watermarks = dict(checkpoint.get('watermarks', {}))  # table -> (ModifiedDate, seq) of the last change
+        self.high_seq = dict(checkpoint.get('high_seq', {}))  # table -> highest seq seen, to tell inserts from updates
+        self._seen = LRUCache(maxsize=batch_size * 10)  # (table, seq, modified) already emitted
+
+    def checkpoint(self):
+        """Where the feed is up to, to save and pass back to ChangeFeed(checkpoint=...) to resume later"""
+        return {'watermarks': dict(self.watermarks), 'high_seq': dict(self.high_seq)}
+
+    def poll(self):
+        """
+        Reads every change since the last poll
+
+        :return: List of Change. Per table, the inserts in seq order, then the updates oldest first
+        """
+        changes = []
+        with syn.get_engine(self.engine).connect() as conn:
+            for table_name in self.tables:
+                if table_name not in self.watermarks:
+                    self._start_from_latest(conn, table_name)
+                changes += self._poll_table(conn, table_name)
+        return changes
+
+    def __iter__(self):
+        while True:
+            changes = self.poll()
+            yield from changes
+            if not changes:
+                time.sleep(self.poll_interval)
+
+    async def __aiter__(self):
+        while True:
+            # Polls run in a thread so a slow query doesn't block the event loop
+            changes = await asyncio.to_thread(self.poll)
+            for change in changes:
+                yield change
+            if not changes:
+                await asyncio.sleep(self.poll_interval)
+
+    def _start_from_latest(self, conn, table_name):
+        seq_name, watermark_names = MIRROR_TABLES[table_name]
+        table = reflection.mapped(table_name).__table__
+        latest, high_seq = conn.execute(select(func.max(table.c[watermark_names[0]]),
+                                               func.max(table.c[seq_name]))).one()
+        self.watermarks[table_name] = (latest, high_seq or 0) if latest is not None else (None, None)
+        self.high_seq[table_name] = high_seq or 0
+
+    def _poll_table(self, conn, table_name):
+        seq_name = MIRROR_TABLES[table_name][0]
+        changes = []
+        inserted = {}  # seq -> ModifiedDate of the inserts emitted this poll, so the pass below doesn't repeat them
+        while True:
+            rows = [dict(row._mapping) for row in conn.execute(
+                new_rows_query(table_name, self.high_seq.get(table_name) or 0, self.batch_size))]
+            for row in rows:
+                modified = row.pop('_watermark')
+                seq = row[seq_name]
+                self.high_seq[table_name] = seq
+                inserted[seq] = modified
+                changes.append(Change(table_name, 'insert', seq, modified, row))
+            if len(rows) < self.batch_size:
+                break
+        while True:
+            last_watermark, last_seq = self.watermarks[table_name]
+            query = changes_query(table_name, last_watermark, last_seq, self.batch_size, include_null=False)
+            rows = [dict(row._mapping) for row in conn.execute(query)]
+            for row in rows:
+                modified = row.pop('_watermark')
+                seq = row[seq_name]
+                self.watermarks[table_name] = (modified, seq)
+                if (table_name, seq, modified) in self._seen or (seq in inserted and inserted[seq] == modified):
+                    continue
+                self._seen.put((table_name, seq, modified), True)
+                high_seq = self.high_seq.get(table_name) or last_seq or 0
+                kind = 'insert' if seq > high_seq else 'update'
+                self.high_seq[table_name] = max(high_seq, seq)
+                changes.append(Change(table_name, kind, seq, modified, row))
+            if len(rows) < self.batch_size:
+                return changes
@@ -0,0 +1,21 @@
+"""
+Conversions of the values read from (and passed to) Synergetic, shared by the modules that need them.
+"""
+import datetime as dt
+
+
+def as_date(value):
+    """A date from a date, datetime or ISO format string. None is passed through"""
+    if isinstance(value, str):
+        value = dt.datetime.fromisoformat(value)
+    return value.date() if isinstance(value, dt.datetime) else value
+
+
+def day_start(value):
+    """Midnight at the start of the day of a date, datetime or ISO format string, as a datetime"""
+    return dt.datetime.combine(as_date(value), dt.time.min)
+
+
+def normalise(value):
+    """Strips strings, as char columns (e.g. codes) can come back padded. Anything else is passed through"""
+    return value.strip() if isinstance(value, str) else value
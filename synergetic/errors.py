@@ -6,3 +6,6 @@ class LookUpError(Exception):  # Needs to go into a separate errors file
 class MissingValueError(Exception):
     pass
 
+
+class InvalidCodeError(Exception):
+    pass
@@ -1,12 +1,12 @@
 from sqlalchemy.ext.automap import automap_base
-from synergetic_session import Synergetic
+from synergetic_session import Synergetic, get_engine
 from Attendance.Attendance import create_attendance_master, AttendanceMaster
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import MetaData
 import datetime
 import pyodbc
 
 
-engine_test = create_engine("mssql+pyodbc://@SynTest")
+engine_test = get_engine('test')
 
 # Only deal with these tables
 metadata = MetaData()
@@ -0,0 +1,185 @@
+"""
+Opt-in query instrumentation.
+
+While instrument() is active every statement run on the instrumented engines is timed and recorded against its
+fingerprint (the statement with literals and parameter lists collapsed), so you can see how many statements a call
+issues, how long they take, and which ones are repeated enough to be N+1 patterns. Row counts are the rows affected
+by INSERT, UPDATE and DELETE statements; drivers don't report the rows a SELECT returns until they're fetched, so
+reads count none.
+
+Example usage:
+with instrument() as stats:
+    mark_rolls()
+print(stats.n_plus_one())
+print(stats.export())
+"""
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+import synergetic.synergetic_session as syn
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf'))
+# A fingerprint run at least this many times on one connection (i.e. one session) is flagged as N+1
+N_PLUS_ONE_THRESHOLD = 10
+# Key in Connection.info of the token identifying a checkout of a pooled connection
+_TOKEN = 'synergetic_query_stats_token'
+
+_STRINGS = re.compile(r"N?'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement):
+    """The statement with literals replaced by ? and lists of parameters (e.g. chunked IN) collapsed to (?)"""
+    statement = _STRINGS.sub('?', statement)
+    statement = _NUMBERS.sub('?', statement)
+    statement = _LISTS.sub('(?)', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+
+class StatementStats:
+    """Stats for one fingerprint"""
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows_affected = 0  # INSERT, UPDATE and DELETE only
+        self.histogram = [0] * len(BUCKETS_MS)
+
+    def record(self, elapsed_ms, rows_affected):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if rows_affected is not None and rows_affected >= 0:
+            self.rows_affected += rows_affected
+        for i, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.histogram[i] += 1
+                break
+
+    def export(self):
+        return {
+            'fingerprint': self.fingerprint,
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'rows_affected': self.rows_affected,
+            'histogram': {str(bound): n for bound, n in zip(BUCKETS_MS, self.histogram) if n},
+        }
+
+
+class QueryStats:
+    """Everything recorded by one instrument() block"""
+
+    def __init__(self, n_plus_one_threshold=N_PLUS_ONE_THRESHOLD):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.statements = {}  # fingerprint -> StatementStats
+        self._per_connection = {}  # (connection token, fingerprint) -> count
+        self._flagged = set()
+        self._lock = threading.Lock()
+
+    def record(self, connection, statement, elapsed_ms, rows_affected):
+        key = fingerprint(statement)
+        with self._lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = self.statements[key] = StatementStats(key)
+            stats.record(elapsed_ms, rows_affected)
+            # Keyed on a token rather than id(connection), as ids are reused once a Connection is garbage collected
+            token = connection.info.setdefault(_TOKEN, object())
+            per_connection = self._per_connection.get((token, key), 0) + 1
+            self._per_connection[(token, key)] = per_connection
+            if per_connection >= self.n_plus_one_threshold:
+                self._flagged.add(key)
+
+    @property
+    def count(self):
+        return sum(stats.count for stats in self.statements.values())
+
+    @property
+    def total_ms(self):
+        return sum(stats.total_ms for stats in self.statements.values())
+
+    def n_plus_one(self):
+        """Fingerprints run at least n_plus_one_threshold times on one connection, most run first"""
+        return sorted((self.statements[key] for key in self._flagged), key=lambda stats: -stats.count)
+
+    def slowest(self, n=10):
+        """The n fingerprints with the most total time"""
+        return sorted(self.statements.values(), key=lambda stats: -stats.total_ms)[:n]
+
+    def export(self):
+        """Plain dict of everything recorded, e.g. for json.dumps or a structured log"""
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'n_plus_one': [stats.fingerprint for stats in self.n_plus_one()],
+            'statements': [stats.export() for stats in self.slowest(len(self.statements))],
+        }
+
+
+@contextmanager
+def instrument(engines=None, n_plus_one_threshold=N_PLUS_ONE_THRESHOLD, export_hook=None):
+    """
+    Records every statement run on the engines while the block is active
+
+    :param engines: Engine names (see synergetic_session.get_engine) or Engines. Defaults to the default engine. Pass
+    [sqlalchemy.engine.Engine] to record every engine in the process, including ones created inside the block
+    :param n_plus_one_threshold: Runs of one fingerprint on one connection before it's flagged as N+1
+    :param export_hook: Called with QueryStats.export() when the block exits. Defaults to logging it at DEBUG, and
+    any N+1 patterns at WARNING
+    :return: QueryStats, filled in as statements run
+    """
+    stats = QueryStats(n_plus_one_threshold)
+    if engines is None:
+        engines = [syn.get_engine()]
+    else:
+        engines = [syn.get_engine(engine) if isinstance(engine, str) else engine for engine in engines]
+
+    # The start time is kept on the statement's execution context, so a statement that was already running when the
+    # block began (e.g. on another thread) has none and isn't recorded
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.synergetic_query_start = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, 'synergetic_query_start', None)
+        if start is None:
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        dml = context.isinsert or context.isupdate or context.isdelete
+        stats.record(conn, statement, elapsed_ms, getattr(cursor, 'rowcount', None) if dml else None)
+
+    # Connection.info lives as long as the pooled connection, so the token is dropped when it goes back to the pool and
+    # the next checkout (i.e. the next session) counts afresh
+    def checkin(dbapi_connection, connection_record):
+        connection_record.info.pop(_TOKEN, None)
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(engine, 'checkin', checkin)
+    try:
+        yield stats
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+            event.remove(engine, 'after_cursor_execute', after_cursor_execute)
+            event.remove(engine, 'checkin', checkin)
+        if export_hook is not None:
+            export_hook(stats.export())
+        else:
+            logger.debug("Query stats: %s", stats.export())
+            for flagged in stats.n_plus_one():
+                logger.warning("Possible N+1: %s run %s times", flagged.fingerprint, flagged.count)
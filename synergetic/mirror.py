@@ -0,0 +1,223 @@
+"""
+Local read mirror of the attendance tables.
+
+A Mirror keeps a SQLite copy of AttendanceMaster, tAttendances and AbsenceEvents, synced incrementally: each table's
+watermark is the last (ModifiedDate, seq) copied, so a sync only reads rows changed since the last one, in keyset
+ordered batches. The watermark is saved in the mirror with each batch, so an interrupted sync resumes where it
+stopped. Rows are often inserted without a ModifiedDate (create_t_attendances doesn't set one), which would sort
+before the watermark, so new rows are copied first by seq, after the highest seq already in the mirror. After the
+first sync, changed rows are then found by ModifiedDate alone, which an index on it can serve. Deletes on the server
+aren't mirrored.
+
+The mirror is registered as a named engine, so the read APIs run against it unchanged, e.g.
+mirror = Mirror('/data/synergetic_mirror.db')
+mirror.sync()
+for batch in stream_attendance(engine='mirror', fileyear=2022):
+    ...
+"""
+import datetime as dt
+
+from sqlalchemy import Boolean, Column, DateTime, Integer, MetaData, String, Table, and_, func, inspect, literal, or_, \
+    select
+from synergetic import reflection
+import synergetic.synergetic_session as syn
+
+# Table -> (primary key seq, watermark columns in order of preference)
+MIRROR_TABLES = {
+    'AttendanceMaster': ('AttendanceMasterSeq', ('ModifiedDate', 'CreatedDate')),
+    'tAttendances': ('AttendanceSeq', ('ModifiedDate',)),
+    'AbsenceEvents': ('AbsenceEventsSeq', ('ModifiedDate', 'CreatedDate')),
+}
+BATCH_SIZE = 10000
+# Rows without a ModifiedDate sort (and sync) first
+_FLOOR = dt.datetime(1900, 1, 1)
+
+
+class Mirror:
+    """
+    A local SQLite mirror of the attendance tables
+
+    :param path: Path of the SQLite file
+    :param name: Name the mirror is registered under in the engine registry
+    :param source: Name of the engine to sync from. Defaults to synergetic_session.DEFAULT_ENGINE
+    :param batch_size: Rows read and written per batch (and per checkpoint)
+    """
+
+    def __init__(self, path, name='mirror', source=None, batch_size=BATCH_SIZE):
+        self.name = name
+        self.source = source
+        self.batch_size = batch_size
+        syn.configure_engine(name, f"sqlite:///{path}")
+        self.metadata = MetaData()
+        self.state = Table('_mirror_state', self.metadata,
+                           Column('table_name', String(128), primary_key=True),
+                           Column('watermark', DateTime),
+                           Column('seq', Integer),
+                           Column('synced_at', DateTime),
+                           Column('complete', Boolean))  # Whether the first sync has finished
+        self._tables = {}
+
+    @property
+    def engine(self):
+        return syn.get_engine(self.name)
+
+    def sync(self, tables=None):
+        """
+        Copies rows changed since the last sync
+
+        :param tables: Names of the tables to sync. Defaults to every table in MIRROR_TABLES
+        :return: dict of table name -> rows copied
+        """
+        copied = {}
+        for table_name in tables or MIRROR_TABLES:
+            copied[table_name] = self._sync_table(table_name)
+        return copied
+
+    def watermark(self, table_name):
+        """(ModifiedDate, seq) of the last row synced for a table, or (None, None) before the first sync"""
+        self._create()
+        with self.engine.connect() as conn:
+            row = conn.execute(select(self.state.c.watermark, self.state.c.seq)
+                               .where(self.state.c.table_name == table_name)).first()
+        return (row.watermark, row.seq) if row is not None else (None, None)
+
+    def reset(self, table_name):
+        """Forgets a table's watermark, so the next sync copies it again from the start"""
+        self._create()
+        with self.engine.begin() as conn:
+            conn.execute(self.state.delete().where(self.state.c.table_name == table_name))
+
+    def _create(self):
+        if self._tables:
+            return
+        for table_name in MIRROR_TABLES:
+            source_table = reflection.mapped(table_name).__table__
+            # Generic types, the server's (e.g. mssql BIT) don't all exist in SQLite
+            Table(table_name, self.metadata,
+                  *[Column(col.name, _generic(col.type), primary_key=col.primary_key, autoincrement=False)
+                    for col in source_table.columns])
+            self._tables[table_name] = self.metadata.tables[table_name]
+        self.metadata.create_all(self.engine)
+        with self.engine.begin() as conn:
+            # Mirrors created before the column was added
+            if 'complete' not in {col['name'] for col in inspect(conn).get_columns(self.state.name)}:
+                conn.exec_driver_sql(f"ALTER TABLE {self.state.name} ADD COLUMN complete BOOLEAN")
+
+    def _sync_table(self, table_name):
+        self._create()
+        seq_name = MIRROR_TABLES[table_name][0]
+        mirror_table = self._tables[table_name]
+        copied = 0
+        # The first sync copies everything, ordered by the coalesced watermark so rows without a ModifiedDate are
+        # included. After that, new rows are copied by seq first, whatever their ModifiedDate, and updates are read by
+        # ModifiedDate alone, which can use an index on it. Rows with a ModifiedDate past the watermark are copied
+        # again by the second pass, which replaces them
+        complete = self._complete(table_name)
+        if complete:
+            copied += self._sync_new_rows(table_name)
+        while True:
+            last_watermark, last_seq = self.watermark(table_name)
+            query = changes_query(table_name, last_watermark, last_seq, self.batch_size, include_null=not complete)
+            with syn.get_engine(self.source).connect() as conn:
+                rows = [dict(row._mapping) for row in conn.execute(query)]
+            if not rows:
+                break
+            last = rows[-1]
+            with self.engine.begin() as conn:
+                conn.execute(mirror_table.insert().prefix_with('OR REPLACE'),
+                             [{col.name: row[col.name] for col in mirror_table.columns} for row in rows])
+                conn.execute(self.state.insert().prefix_with('OR REPLACE'),
+                             {'table_name': table_name, 'watermark': last['_watermark'], 'seq': last[seq_name],
+                              'synced_at': dt.datetime.now(), 'complete': complete})
+            copied += len(rows)
+            if len(rows) < self.batch_size:
+                break
+        if not complete:
+            self._set_complete(table_name)
+        return copied
+
+    def _complete(self, table_name):
+        with self.engine.connect() as conn:
+            return bool(conn.execute(select(self.state.c.complete)
+                                     .where(self.state.c.table_name == table_name)).scalar())
+
+    def _set_complete(self, table_name):
+        with self.engine.begin() as conn:
+            updated = conn.execute(self.state.update().where(self.state.c.table_name == table_name)
+                                   .values(complete=True, synced_at=dt.datetime.now())).rowcount
+            if not updated:  # Nothing to copy yet
+                conn.execute(self.state.insert(), {'table_name': table_name, 'synced_at': dt.datetime.now(),
+                                                   'complete': True})
+
+    def _sync_new_rows(self, table_name):
+        seq_name = MIRROR_TABLES[table_name][0]
+        mirror_table = self._tables[table_name]
+        copied = 0
+        while True:
+            # Deletes aren't mirrored, so the highest seq in the mirror is the last new row copied
+            with self.engine.connect() as conn:
+                high_seq = conn.execute(select(func.max(mirror_table.c[seq_name]))).scalar()
+            with syn.get_engine(self.source).connect() as conn:
+                rows = [dict(row._mapping) for row in conn.execute(new_rows_query(table_name, high_seq or 0,
+                                                                                   self.batch_size))]
+            if not rows:
+                break
+            with self.engine.begin() as conn:
+                conn.execute(mirror_table.insert().prefix_with('OR REPLACE'),
+                             [{col.name: row[col.name] for col in mirror_table.columns} for row in rows])
+            copied += len(rows)
+            if len(rows) < self.batch_size:
+                break
+        return copied
+
+
+def changes_query(table_name, last_watermark=None, last_seq=None, limit=BATCH_SIZE, include_null=True):
+    """
+    Keyset select of the rows changed after (last_watermark, last_seq), ordered by watermark then seq. Each row has
+    the watermark it was ordered by as _watermark.
+
+    :param table_name: One of MIRROR_TABLES
+    :param last_watermark: ModifiedDate of the last row already seen, None to start from the beginning
+    :param last_seq: Seq of the last row already seen
+    :param limit: Rows to select
+    :param include_null: Include rows without a ModifiedDate (using CreatedDate where there is one). Turning it off
+    compares ModifiedDate directly, which can use an index on it
+    :return: sqlalchemy Select
+    """
+    seq_name, watermark_names = MIRROR_TABLES[table_name]
+    table = reflection.mapped(table_name).__table__
+    seq = table.c[seq_name]
+    if include_null:
+        watermark = func.coalesce(*[table.c[name] for name in watermark_names], literal(_FLOOR, DateTime()))
+    else:
+        watermark = table.c[watermark_names[0]]
+    query = select(table, watermark.label('_watermark')).order_by(watermark, seq).limit(limit)
+    if last_watermark is not None:
+        query = query.where(or_(watermark > last_watermark, and_(watermark == last_watermark, seq > last_seq)))
+    elif not include_null:
+        query = query.where(watermark.isnot(None))
+    return query
+
+
+def new_rows_query(table_name, last_seq, limit=BATCH_SIZE):
+    """
+    Keyset select of the rows with a seq after last_seq, ordered by seq, i.e. the rows inserted since, whether or not
+    they have a ModifiedDate. Each row has its ModifiedDate as _watermark, as changes_query(include_null=False) does.
+
+    :param table_name: One of MIRROR_TABLES
+    :param last_seq: Highest seq already seen
+    :param limit: Rows to select
+    :return: sqlalchemy Select
+    """
+    seq_name, watermark_names = MIRROR_TABLES[table_name]
+    table = reflection.mapped(table_name).__table__
+    seq = table.c[seq_name]
+    return select(table, table.c[watermark_names[0]].label('_watermark')).where(seq > last_seq).order_by(seq) \
+        .limit(limit)
+
+
+def _generic(type_):
+    try:
+        return type_.as_generic()
+    except NotImplementedError:
+        return String()
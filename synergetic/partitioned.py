@@ -0,0 +1,277 @@
+"""
+Parallel partitioned extraction.
+
+A full history read as one query is one cursor on one connection. Here the read is split into partitions (by seq
+range, date range or semester), each partition is streamed on its own pooled connection by a thread pool sized to the
+engine's pool, and the batches are either merged back into one stream or written to a file per partition.
+
+Each partition is ordered by seq and the partitions are in key order, so stream() with by_seq partitions is in seq
+order overall, and with by_date or by_semester partitions in date or semester order, then seq.
+
+Example usage:
+for batch in stream(by_seq('tAttendances', partitions=16)):
+    warehouse.load(batch)
+
+paths = write_files(by_semester('AttendanceMaster'), '/data/extract', format='parquet')
+"""
+import csv
+import datetime as dt
+import decimal
+import math
+import os
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func, select
+from synergetic import reflection
+from synergetic.convert import day_start
+from synergetic.Attendance.Extract import BATCH_SIZE, attendance_query, stream_query
+from synergetic.School import school
+import synergetic.synergetic_session as syn
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Optional, only needed to write Parquet files
+    pyarrow = None
+
+# Table -> (seq column, date column). tAttendances is read joined to its AttendanceMaster, see
+# Extract.attendance_query, and partitioned on the master's date and semester
+PARTITION_TABLES = {
+    'AttendanceMaster': ('AttendanceMasterSeq', 'AttendanceDate'),
+    'tAttendances': ('AttendanceSeq', 'AttendanceDate'),
+    'StaffSchedule': ('StaffScheduleSeq', 'ScheduleDateTimeFrom'),
+}
+# Batches a partition can read ahead of the merged stream
+PREFETCH = 4
+
+Partition = namedtuple('Partition', 'name query')
+
+_DONE = object()
+
+
+def by_seq(table_name, partitions=8, engine=None):
+    """
+    Splits a table into seq ranges of equal width between its lowest and highest seq
+
+    :param table_name: One of PARTITION_TABLES
+    :param partitions: Number of ranges
+    :param engine: Name of the engine to read the seq range from
+    :return: List of Partition
+    """
+    seq = _table(table_name).c[PARTITION_TABLES[table_name][0]]
+    with syn.get_engine(engine).connect() as conn:
+        low, high = conn.execute(select(func.min(seq), func.max(seq))).one()
+    if low is None:
+        return []
+    width = math.ceil((high - low + 1) / partitions)
+    return [Partition(f'{table_name}-{start}-{start + width - 1}',
+                      _query(table_name).where(seq >= start, seq < start + width))
+            for start in range(low, high + 1, width)]
+
+
+def by_date(table_name, date_from, date_to, days=31):
+    """
+    Splits a date range into ranges of days
+
+    :param table_name: One of PARTITION_TABLES
+    :param date_from: First date to include
+    :param date_to: Last date to include
+    :param days: Days per partition
+    :return: List of Partition
+    """
+    date_column = _date_column(table_name)
+    partitions = []
+    start = day_start(date_from)
+    end = day_start(date_to) + dt.timedelta(days=1)
+    while start < end:
+        stop = min(start + dt.timedelta(days=days), end)
+        partitions.append(Partition(f'{table_name}-{start:%Y%m%d}-{stop - dt.timedelta(days=1):%Y%m%d}',
+                                    _query(table_name).where(date_column >= start, date_column < stop)))
+        start = stop
+    return partitions
+
+
+def by_semester(table_name, semesters=None, engine=None):
+    """
+    One partition per semester. StaffSchedule has no FileYear/FileSemester, so it's split on the semesters' dates
+    from school.calendar
+
+    :param table_name: One of PARTITION_TABLES
+    :param semesters: (FileYear, FileSemester) pairs. Defaults to every semester in the calendar
+    :param engine: Name of the engine the calendar is read from
+    :return: List of Partition
+    """
+    calendar = school.calendar(engine)
+    if semesters is None:
+        semesters = [(semester.FileYear, semester.FileSemester) for semester in calendar.semesters()]
+    partitions = []
+    for fileyear, filesemester in sorted(semesters):
+        name = f'{table_name}-{fileyear}-{filesemester}'
+        if table_name == 'StaffSchedule':
+            semester = calendar.get(fileyear, filesemester)
+            if semester is None or semester.StartDate is None or semester.EndDate is None:
+                raise ValueError(f"Semester {fileyear} {filesemester} has no dates to split StaffSchedule on")
+            date_column = _date_column(table_name)
+            query = _query(table_name).where(
+                date_column >= day_start(semester.StartDate),
+                date_column < day_start(semester.EndDate) + dt.timedelta(days=1))
+        else:
+            master = reflection.mapped('AttendanceMaster').__table__
+            query = _query(table_name).where(master.c.FileYear == fileyear, master.c.FileSemester == filesemester)
+        partitions.append(Partition(name, query))
+    return partitions
+
+
+def stream(partitions, engine=None, max_workers=None, batch_size=BATCH_SIZE, prefetch=PREFETCH):
+    """
+    Reads the partitions concurrently and yields their batches as one stream, in partition order
+
+    :param partitions: From by_seq, by_date or by_semester
+    :param engine: Name of the engine to read from, see synergetic_session.get_engine
+    :param max_workers: Partitions read at once. Defaults to the engine's pool_size
+    :param batch_size: Rows per batch
+    :param prefetch: Batches each partition can read ahead, which bounds the memory used
+    :return: Generator of lists of rows
+    """
+    partitions = list(partitions)
+    queues = [queue.Queue(maxsize=prefetch) for _ in partitions]
+    stop = threading.Event()
+
+    def put(batches, item):
+        # Gives up when the stream is closed, so a reader never waits on a queue nobody reads
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read(partition, batches):
+        try:
+            for batch in stream_query(partition.query, batch_size, engine):
+                if not put(batches, batch):
+                    return
+            put(batches, _DONE)
+        except Exception as exc:
+            put(batches, exc)
+
+    with ThreadPoolExecutor(max_workers=_workers(engine, max_workers), thread_name_prefix='synergetic-extract') \
+            as executor:
+        for partition, batches in zip(partitions, queues):
+            executor.submit(read, partition, batches)
+        try:
+            for batches in queues:
+                while True:
+                    batch = batches.get()
+                    if batch is _DONE:
+                        break
+                    if isinstance(batch, Exception):
+                        raise batch
+                    yield batch
+        finally:
+            # Stops the readers when the stream is closed early (or fails), rather than waiting for them to finish
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def write_files(partitions, directory, format='parquet', engine=None, max_workers=None, batch_size=BATCH_SIZE):
+    """
+    Reads the partitions concurrently, writing each to its own file named after the partition
+
+    :param partitions: From by_seq, by_date or by_semester
+    :param directory: Directory to write to, created if it doesn't exist
+    :param format: 'parquet' (needs pyarrow) or 'csv'
+    :param engine: Name of the engine to read from, see synergetic_session.get_engine
+    :param max_workers: Partitions read at once. Defaults to the engine's pool_size
+    :param batch_size: Rows per batch (and per Parquet row group)
+    :return: List of the paths written, in partition order
+    """
+    if format == 'parquet' and pyarrow is None:
+        raise ImportError("pyarrow is required to write Parquet files")
+    if format not in ('parquet', 'csv'):
+        raise ValueError(f"Unknown format {format!r}, expected 'parquet' or 'csv'")
+    os.makedirs(directory, exist_ok=True)
+    writer = _write_parquet if format == 'parquet' else _write_csv
+
+    def write(partition):
+        path = os.path.join(directory, f'{partition.name}.{format}')
+        tmp_path = f'{path}.tmp'
+        writer(partition.query, tmp_path, engine, batch_size)
+        os.replace(tmp_path, path)  # Only complete files appear under the final name
+        return path
+
+    with ThreadPoolExecutor(max_workers=_workers(engine, max_workers), thread_name_prefix='synergetic-extract') \
+            as executor:
+        return list(executor.map(write, partitions))
+
+
+def _write_csv(query, path, engine, batch_size):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([col.name for col in query.selected_columns])
+        for batch in stream_query(query, batch_size, engine):
+            writer.writerows(batch)
+
+
+def _write_parquet(query, path, engine, batch_size):
+    # The schema comes from the column types, so it's the same for every batch even when a batch's values are all NULL
+    columns = list(query.selected_columns)
+    schema = pyarrow.schema([(col.name, _arrow_type(col.type)) for col in columns])
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for batch in stream_query(query, batch_size, engine):
+            arrays = [pyarrow.array(_arrow_values(values, field.type), type=field.type)
+                      for values, field in zip(zip(*batch), schema)]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+
+
+def _arrow_type(sql_type):
+    try:
+        python_type = sql_type.python_type
+    except NotImplementedError:
+        return pyarrow.string()
+    return {
+        bool: pyarrow.bool_(),
+        int: pyarrow.int64(),
+        float: pyarrow.float64(),
+        decimal.Decimal: pyarrow.float64(),
+        dt.datetime: pyarrow.timestamp('us'),
+        dt.date: pyarrow.date32(),
+        dt.time: pyarrow.time64('us'),
+        bytes: pyarrow.binary(),
+    }.get(python_type, pyarrow.string())
+
+
+def _arrow_values(values, arrow_type):
+    if arrow_type == pyarrow.float64():
+        return [float(value) if value is not None else None for value in values]
+    if arrow_type == pyarrow.string():
+        return [str(value) if value is not None else None for value in values]
+    return list(values)
+
+
+def _workers(engine, max_workers):
+    if max_workers is not None:
+        return max_workers
+    return syn.pool_size(engine)
+
+
+def _table(table_name):
+    if table_name not in PARTITION_TABLES:
+        raise ValueError(f"Can't partition {table_name}, expected one of {list(PARTITION_TABLES)}")
+    return reflection.mapped(table_name).__table__
+
+
+def _query(table_name):
+    if table_name == 'tAttendances':
+        return attendance_query()
+    table = _table(table_name)
+    return select(table).order_by(table.c[PARTITION_TABLES[table_name][0]])
+
+
+def _date_column(table_name):
+    table = _table('AttendanceMaster' if table_name == 'tAttendances' else table_name)
+    return table.c[PARTITION_TABLES[table_name][1]]
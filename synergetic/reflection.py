@@ -0,0 +1,156 @@
+"""
+Lazy, cached reflection of Synergetic tables.
+
+Tables are registered when a module is imported, but only reflected and mapped the first time the mapped class is
+used, so importing synergetic doesn't touch the database. Each reflected table is pickled to disk, keyed by server,
+database and a fingerprint of the table's schema (its modify_date), so warm starts skip reflection entirely.
+
+Set the SYNERGETIC_CACHE_DIR environment variable to move the cache, or set it to an empty string to disable it.
+"""
+import hashlib
+import os
+import pickle
+import re
+import shutil
+import threading
+from collections import namedtuple
+
+import sqlalchemy
+from sqlalchemy import MetaData, bindparam, text
+from sqlalchemy.ext.automap import automap_base
+import synergetic.synergetic_session as syn
+
+CACHE_DIR = os.environ.get('SYNERGETIC_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'synergetic'))
+
+# One round trip fingerprints every registered table that hasn't been fingerprinted yet
+_FINGERPRINT_QUERY = text(
+    "SELECT o.name, o.modify_date, @@SERVERNAME AS server_name, DB_NAME() AS database_name "
+    "FROM sys.objects o WHERE o.type IN ('U', 'V') AND o.name IN :names"
+).bindparams(bindparam('names', expanding=True))
+
+_lock = threading.RLock()
+_registered = {}  # table name -> (mixin, implicit_returning)
+_mapped = {}  # table name -> mapped class
+_fingerprints = {}  # table name -> (server, database, fingerprint) or None when it couldn't be found
+_row_classes = {}  # table name -> namedtuple of its columns
+
+
+def register(table_name, mixin=None, implicit_returning=True):
+    """
+    Registers a table to be reflected and mapped the first time it's used
+
+    :param table_name: Name of the table in the Synergetic database
+    :param mixin: Class whose methods (e.g. lookups) are added to the mapped class
+    :param implicit_returning: Set to False for tables with triggers, as SQL Server won't allow a plain OUTPUT
+    :return:
+    """
+    with _lock:
+        _registered[table_name] = (mixin, implicit_returning)
+
+
+def mapped(table_name):
+    """
+    Returns the mapped class for a registered table, reflecting it (or loading it from the cache) on first use
+
+    :param table_name: Name of the table in the Synergetic database
+    :return: The mapped class
+    """
+    cls = _mapped.get(table_name)
+    if cls is not None:
+        return cls
+    with _lock:
+        if table_name not in _mapped:
+            if table_name not in _registered:
+                raise KeyError(f"{table_name} hasn't been registered for reflection")
+            mixin, implicit_returning = _registered[table_name]
+            table = _load_table(table_name)
+            table.implicit_returning = implicit_returning
+            Base = automap_base(metadata=table.metadata)
+            bases = (mixin, Base) if mixin is not None else (Base,)
+            cls = type(table_name, bases, {'__table__': table})
+            Base.prepare()
+            _mapped[table_name] = cls
+    return _mapped[table_name]
+
+
+def row_class(table_name):
+    """
+    Returns a namedtuple class with a field per column of a registered table, for read-only rows that don't go through
+    the ORM (no identity map or change tracking)
+
+    :param table_name: Name of the table in the Synergetic database
+    :return: namedtuple class named <table_name>Row
+    """
+    cls = _row_classes.get(table_name)
+    if cls is None:
+        cls = _row_classes[table_name] = namedtuple(f'{table_name}Row', mapped(table_name).__table__.columns.keys())
+    return cls
+
+
+def module_getattr(module_name, *table_names):
+    """
+    Builds a module level __getattr__ so the mapped classes can still be imported by name, e.g.
+    `from synergetic.Attendance.Attendance import AttendanceMaster`, without reflecting at import time
+
+    :param module_name: __name__ of the module
+    :param table_names: Tables exposed by the module
+    :return:
+    """
+    def __getattr__(name):
+        if name in table_names:
+            return mapped(name)
+        raise AttributeError(f"module {module_name!r} has no attribute {name!r}")
+    return __getattr__
+
+
+def clear_cache():
+    """Deletes the on-disk reflection cache. Tables already mapped in this process are unaffected"""
+    with _lock:
+        _fingerprints.clear()
+        if CACHE_DIR and os.path.isdir(CACHE_DIR):
+            shutil.rmtree(CACHE_DIR)
+
+
+def _load_table(table_name):
+    path = _cache_path(table_name)
+    if path is not None and os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f).tables[table_name]
+        except (OSError, EOFError, KeyError, AttributeError, pickle.UnpicklingError):
+            pass  # Unreadable or stale cache, reflect it again
+    metadata = MetaData()
+    metadata.reflect(syn.get_engine(), only=[table_name], views=True, resolve_fks=False)
+    if path is not None:
+        _write_cache(path, metadata)
+    return metadata.tables[table_name]
+
+
+def _cache_path(table_name):
+    # The fingerprint query reads SQL Server's catalog, other databases (e.g. the benchmark stand-in) aren't cached
+    if not CACHE_DIR or syn.get_engine().dialect.name != 'mssql':
+        return None
+    if table_name not in _fingerprints:
+        names = [name for name in _registered if name not in _fingerprints]
+        with syn.get_engine().connect() as conn:
+            rows = conn.execute(_FINGERPRINT_QUERY, {'names': names}).all()
+        _fingerprints.update(dict.fromkeys(names))
+        for row in rows:
+            key = f"{row.name}|{row.modify_date.isoformat()}|{sqlalchemy.__version__}"
+            _fingerprints[row.name] = (row.server_name, row.database_name, hashlib.sha1(key.encode()).hexdigest()[:16])
+    if _fingerprints.get(table_name) is None:
+        return None
+    server, database, fingerprint = _fingerprints[table_name]
+    directory = re.sub(r'[^\w.-]', '_', f"{server}-{database}")
+    return os.path.join(CACHE_DIR, directory, f"{table_name}-{fingerprint}.pickle")
+
+
+def _write_cache(path, metadata):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(metadata, f)
+        os.replace(tmp_path, path)  # Atomic, so concurrent workers never read a half-written cache
+    except OSError:
+        pass  # The cache is only an optimisation
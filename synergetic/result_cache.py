@@ -0,0 +1,235 @@
+"""
+Disk cache of query results for closed semesters.
+
+Once a semester has finished its attendance doesn't change, so historical reports don't need to read it from the
+server every time. A ResultCache keeps the rows of queries scoped to one closed FileYear/FileSemester in a local SQLite
+file, keyed by the compiled statement, its parameters and the server. Semesters before the one with
+FileSemesters.SystemCurrentFlag set count as closed; the current and later ones are always read from the server. When
+the current semester moves the whole cache is dropped, and the least recently used results are evicted once the file
+grows past max_bytes.
+
+Example usage:
+cache = ResultCache()
+for batch in stream_attendance(fileyear=2021, filesemester=2, cache=cache):
+    ...
+"""
+import datetime as dt
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+
+from synergetic import reflection
+from synergetic.Attendance.Extract import stream_query
+from synergetic.School import school
+from synergetic.instrumentation import fingerprint
+import synergetic.synergetic_session as syn
+
+DEFAULT_PATH = os.path.join(reflection.CACHE_DIR, 'results.sqlite') if reflection.CACHE_DIR else None
+MAX_BYTES = 2 * 1024 ** 3
+BATCH_SIZE = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    fileyear INTEGER NOT NULL,
+    filesemester INTEGER NOT NULL,
+    columns BLOB NOT NULL,
+    rows INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    created TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS batches (
+    key TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (key, number)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class ResultCache:
+    """
+    A disk cache of closed semesters' query results
+
+    :param path: SQLite file to keep the results in. Defaults to results.sqlite in reflection.CACHE_DIR
+    :param max_bytes: Compressed size of results to keep before the least recently used are evicted
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=MAX_BYTES):
+        if path is None:
+            raise ValueError("No path for the result cache, pass one or set SYNERGETIC_CACHE_DIR")
+        self.path = path
+        self.max_bytes = max_bytes
+        self._current = {}  # engine name -> (FileYear, FileSemester) last seen
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+            # Batches left by a process that stopped part way through a read
+            db.execute("DELETE FROM batches WHERE key NOT IN (SELECT key FROM results)")
+
+    def is_closed(self, fileyear, filesemester, engine=None):
+        """Whether a semester is before the current one, i.e. its results can be cached"""
+        return (fileyear, filesemester) < self.current_semester(engine)
+
+    def current_semester(self, engine=None):
+        """
+        (FileYear, FileSemester) of the semester with SystemCurrentFlag set, from school.calendar. The cache is cleared
+        when it's moved since it was last seen.
+        """
+        current = tuple(school.current_term(engine))
+        name = syn.DEFAULT_ENGINE if engine is None else engine
+        if self._current.get(name) == current:
+            return current
+        with self._lock, self._connect() as db:
+            meta_name = f'current:{_server(engine)}'
+            row = db.execute("SELECT value FROM meta WHERE name = ?", (meta_name,)).fetchone()
+            if row is not None and row[0] != repr(current):
+                db.execute("DELETE FROM batches")
+                db.execute("DELETE FROM results")
+            db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (meta_name, repr(current)))
+        self._current[name] = current
+        return current
+
+    def stream(self, query, fileyear, filesemester, batch_size=BATCH_SIZE, engine=None):
+        """
+        Yields batches of a query's rows, from the cache when it has them. Results of closed semesters are cached as
+        they're read from the server, and only kept once every row has been read.
+
+        :param query: sqlalchemy Select, scoped to fileyear and filesemester (the cache can't check this)
+        :param fileyear: FileYear the query is for
+        :param filesemester: FileSemester the query is for
+        :param batch_size: Rows per batch, when reading from the server
+        :param engine: Name of the engine to read from, see synergetic_session.get_engine
+        :return: Generator of lists of namedtuples, one field per selected column
+        """
+        if not (isinstance(fileyear, int) and isinstance(filesemester, int)
+                and self.is_closed(fileyear, filesemester, engine)):
+            yield from _stream_server(query, batch_size, engine)
+            return
+        key, statement = self._key(query, engine)
+        cached = self._read(key)
+        if cached is not None:
+            yield from cached
+            return
+        columns, rows, size = None, 0, 0
+        complete = False
+        try:
+            for number, batch in enumerate(_stream_server(query, batch_size, engine)):
+                columns = batch[0]._fields if columns is None and batch else columns
+                rows += len(batch)
+                size += self._write_batch(key, number, batch)
+                yield batch
+            complete = size <= self.max_bytes
+        finally:
+            # Results that weren't read to the end (or are too big to keep) are dropped
+            if complete:
+                self._finish(key, statement, fileyear, filesemester, columns or (), rows, size)
+            else:
+                self._drop(key)
+
+    def size(self):
+        """Compressed bytes of the results kept"""
+        with self._connect() as db:
+            return db.execute("SELECT COALESCE(SUM(bytes), 0) FROM results").fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._connect() as db:
+            db.execute("DELETE FROM batches")
+            db.execute("DELETE FROM results")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:  # Commits, or rolls back on an exception
+                yield db
+        finally:
+            db.close()
+
+    def _key(self, query, engine):
+        compiled = query.compile(syn.get_engine(engine))
+        statement = str(compiled)
+        params = sorted((name, repr(value)) for name, value in compiled.params.items())
+        key = hashlib.sha1(repr((_server(engine), statement, params)).encode()).hexdigest()
+        return key, statement
+
+    def _read(self, key):
+        with self._lock, self._connect() as db:
+            row = db.execute("SELECT columns, (SELECT COUNT(*) FROM batches b WHERE b.key = r.key) "
+                             "FROM results r WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        row_class = _row_class(pickle.loads(row[0]))
+        return self._batches(key, row[1], row_class)
+
+    def _batches(self, key, count, row_class):
+        # Read a batch at a time, so a cached semester streams like one read from the server
+        for number in range(count):
+            with self._connect() as db:
+                blob = db.execute("SELECT data FROM batches WHERE key = ? AND number = ?", (key, number)).fetchone()
+            if blob is None:
+                raise KeyError(f"Cached result {key} was evicted while it was being read")
+            yield [row_class._make(values) for values in pickle.loads(zlib.decompress(blob[0]))]
+
+    def _write_batch(self, key, number, batch):
+        blob = zlib.compress(pickle.dumps([tuple(row) for row in batch], pickle.HIGHEST_PROTOCOL))
+        with self._lock, self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO batches (key, number, data) VALUES (?, ?, ?)", (key, number, blob))
+        return len(blob)
+
+    def _finish(self, key, statement, fileyear, filesemester, columns, rows, size):
+        with self._lock, self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO results (key, fingerprint, fileyear, filesemester, columns, rows, "
+                       "bytes, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       (key, fingerprint(statement), fileyear, filesemester, pickle.dumps(list(columns)), rows, size,
+                        dt.datetime.now().isoformat(), time.time()))
+            self._evict(db)
+
+    def _drop(self, key):
+        with self._lock, self._connect() as db:
+            db.execute("DELETE FROM batches WHERE key = ?", (key,))
+            db.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def _evict(self, db):
+        total = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM results").fetchone()[0]
+        for key, size in db.execute("SELECT key, bytes FROM results ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM batches WHERE key = ?", (key,))
+            db.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+
+
+def _stream_server(query, batch_size, engine):
+    for batch in stream_query(query, batch_size, engine):
+        row_class = _row_class(batch[0]._fields)
+        yield [row_class._make(row) for row in batch]
+
+
+_row_classes = {}
+
+
+def _row_class(columns):
+    columns = tuple(columns)
+    if columns not in _row_classes:
+        _row_classes[columns] = namedtuple('ResultRow', columns, rename=True)
+    return _row_classes[columns]
+
+
+def _server(engine):
+    # The URL without its password, so results from different servers never share a key
+    return repr(syn.get_engine(engine).url)
@@ -1,9 +1,144 @@
-from sqlalchemy.ext.automap import automap_base
-from sqlalchemy.orm import Session, sessionmaker
+import os
+import threading
+
+from sqlalchemy.orm import Session
 from sqlalchemy import create_engine, MetaData
+from sqlalchemy.engine import make_url
+
+# Engines are created on first use from these settings. Every setting can be overridden from the environment, e.g.
+# SYNERGETIC_POOL_SIZE=20 or SYNERGETIC_REPLICA_POOL_SIZE=20 for a single engine, and any named engine's URL with
+# SYNERGETIC_URL_<NAME>, e.g. SYNERGETIC_URL_REPLICA
+ENGINE_URLS = {
+    'production': "mssql+pyodbc://@Synergetic",
+    'test': "mssql+pyodbc://@SynTest",
+}
+ENGINE_SETTINGS = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_timeout': 30,  # Seconds to wait for a connection from the pool
+    'pool_recycle': 1800,  # Seconds before a connection is replaced, stops the server or a firewall dropping it first
+    'pool_pre_ping': True,  # Test connections on checkout so dropped ODBC connections are replaced, not raised
+    'fast_executemany': True,
+    'connect_timeout': 15,  # ODBC login timeout in seconds
+}
+# The engine used for reflection and module level queries
+DEFAULT_ENGINE = os.environ.get('SYNERGETIC_DEFAULT_ENGINE', 'test')
+
+_engines = {}
+_settings = {}  # Per engine overrides from configure_engine
+_lock = threading.Lock()
+
+
+def configure_engine(name, url=None, **settings):
+    """
+    Registers (or reconfigures) a named engine. Call before the engine is first used, or it's disposed and recreated.
+
+    Example usage:
+    configure_engine('replica', "mssql+pyodbc://@SynReplica", pool_size=20)
+    with Synergetic.named('replica') as session:
+        ...
+
+    :param name: Name of the engine, e.g. 'production', 'test', 'replica'
+    :param url: SQLAlchemy URL. Defaults to the existing URL for name
+    :param settings: Overrides for ENGINE_SETTINGS, only for this engine
+    :return:
+    """
+    with _lock:
+        if url is not None:
+            ENGINE_URLS[name] = url
+        _settings.setdefault(name, {}).update(settings)
+        engine = _engines.pop(name, None)
+    if engine is not None:
+        engine.dispose()
+
+
+def get_engine(name=None):
+    """
+    Returns the named engine, creating it on first use
+
+    :param name: Name of the engine. Defaults to DEFAULT_ENGINE
+    :return: sqlalchemy Engine
+    """
+    name = DEFAULT_ENGINE if name is None else name
+    engine = _engines.get(name)
+    if engine is not None:
+        return engine
+    with _lock:
+        if name not in _engines:
+            _engines[name] = _create_engine(name)
+        return _engines[name]
+
+
+def pool_status(name=None):
+    """
+    Pool statistics for the engines created so far
 
-engine_prod = create_engine("mssql+pyodbc://@Synergetic")
-engine_test = create_engine("mssql+pyodbc://@SynTest")
+    :param name: Only report this engine
+    :return: dict of engine name -> dict of pool statistics
+    """
+    names = list(_engines) if name is None else [name]
+    stats = {}
+    for engine_name in names:
+        pool = get_engine(engine_name).pool
+        stats[engine_name] = {
+            'size': pool.size() if hasattr(pool, 'size') else None,
+            'checked_in': pool.checkedin() if hasattr(pool, 'checkedin') else None,
+            'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+            'overflow': pool.overflow() if hasattr(pool, 'overflow') else None,
+            'status': pool.status(),
+        }
+    return stats
+
+
+def pool_size(name=None):
+    """
+    The configured pool_size of an engine, e.g. to size a thread pool so it can't ask for more connections than the pool
+    holds. Doesn't create the engine
+
+    :param name: Name of the engine. Defaults to DEFAULT_ENGINE
+    :return: int
+    """
+    return _setting(DEFAULT_ENGINE if name is None else name, 'pool_size')
+
+
+def dispose_engines():
+    """Closes every pooled connection, e.g. after forking a worker process"""
+    with _lock:
+        engines = list(_engines.values())
+        _engines.clear()
+    for engine in engines:
+        engine.dispose()
+
+
+def _setting(name, key):
+    env = os.environ.get(f"SYNERGETIC_{name.upper()}_{key.upper()}", os.environ.get(f"SYNERGETIC_{key.upper()}"))
+    default = _settings.get(name, {}).get(key, ENGINE_SETTINGS[key])
+    if env is None:
+        return default
+    if isinstance(default, bool):
+        return env.lower() in ('1', 'true', 'yes')
+    return type(default)(env)
+
+
+def _create_engine(name):
+    url = os.environ.get(f"SYNERGETIC_URL_{name.upper()}", ENGINE_URLS.get(name))
+    if url is None:
+        raise KeyError(f"No URL configured for the {name!r} engine, use configure_engine or SYNERGETIC_URL_"
+                       f"{name.upper()}")
+    url = make_url(url)
+    kwargs = {
+        'pool_recycle': _setting(name, 'pool_recycle'),
+        'pool_pre_ping': _setting(name, 'pool_pre_ping'),
+        'connect_args': {'timeout': _setting(name, 'connect_timeout')},
+    }
+    # Local stand-ins (e.g. SQLite for the benchmarks) don't take the pool sizing or pyodbc options
+    if url.get_backend_name() != 'sqlite':
+        kwargs.update(pool_size=_setting(name, 'pool_size'),
+                      max_overflow=_setting(name, 'max_overflow'),
+                      pool_timeout=_setting(name, 'pool_timeout'))
+    if url.get_driver_name() == 'pyodbc':
+        kwargs['fast_executemany'] = _setting(name, 'fast_executemany')
+    return create_engine(url, **kwargs)
 
 
 class Synergetic(Session):
@@ -12,15 +147,33 @@ class Synergetic(Session):
 
     @classmethod
     def production(cls):
-        return Synergetic(engine_prod)
+        return Synergetic(get_engine('production'))
 
     @classmethod
     def test(cls):
-        return Synergetic(engine_test)
+        return Synergetic(get_engine('test'))
+
+    @classmethod
+    def named(cls, name):
+        return Synergetic(get_engine(name))
+
+    @staticmethod
+    def instrument(**kwargs):
+        """Records the statements run on the engines in a with block, see synergetic.instrumentation.instrument"""
+        from synergetic.instrumentation import instrument
+        return instrument(**kwargs)
 
 
 # Global metadata object. Add tables to it by using the .reflect(only=[...]) method
 metadata = MetaData()
 
-engine = engine_test
 
+def __getattr__(name):
+    # engine, engine_prod and engine_test are kept for existing code, but now come from the registry
+    if name == 'engine':
+        return get_engine()
+    if name == 'engine_prod':
+        return get_engine('production')
+    if name == 'engine_test':
+        return get_engine('test')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,214 @@
+"""
+Background batching writer.
+
+Adding rows to a session one at a time means an INSERT (and a round trip) per row. A BatchWriter instead takes rows
+from any number of threads onto a bounded queue and a background thread inserts them, grouped by table, with one
+executemany per batch. A batch is written once it has batch_size rows or its oldest row has waited flush_interval
+seconds. When the queue is full, put blocks (or times out), so producers are slowed to the rate the server can take
+rather than buffering without limit. Batches that fail with a transient error (a dropped connection, a deadlock or a
+timeout) are retried with backoff.
+
+The inserts don't return the generated seqs, so it's for rows nothing else needs to refer to straight away, e.g. kiosk
+sign in AbsenceEvents or tAttendances for a master that's already been written.
+
+Example usage:
+with BatchWriter() as writer:
+    for student_id in signed_in:
+        writer.put(create_absence_events(ID=student_id, SchoolInOutStatus='In', EventDateTime=dt.datetime.now()))
+"""
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy.exc import DBAPIError
+from synergetic import reflection
+import synergetic.synergetic_session as syn
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+FLUSH_INTERVAL = 1.0  # Seconds
+MAX_QUEUE = 10000
+RETRIES = 3
+RETRY_BACKOFF = 0.5  # Seconds, doubled after each retry
+# ODBC SQLSTATEs worth retrying: communication link failure, unable to connect, connection rejected, deadlock victim and
+# timeouts
+TRANSIENT_SQLSTATES = {'08S01', '08001', '08004', '40001', 'HYT00', 'HYT01'}
+# Tables put() accepts mapped instances of
+TABLES = ('AttendanceMaster', 'tAttendances', 'AbsenceEvents', 'StaffSchedule', 'StaffScheduleStudentClasses')
+
+_STOP = object()
+
+
+class BatchWriter:
+    """
+    Inserts rows in batches on a background thread
+
+    :param engine: Name of the engine to write to, see synergetic_session.get_engine
+    :param batch_size: Rows per executemany
+    :param flush_interval: Seconds a row can wait for its batch to fill before it's written anyway
+    :param max_queue: Rows that can be waiting on the queue before put blocks
+    :param retries: Attempts after the first for a batch that fails with a transient error
+    :param on_error: Called with (table name, rows, exception) for a batch that couldn't be written. Defaults to
+    logging it; the batch is also kept in writer.failed either way
+    """
+
+    def __init__(self, engine=None, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, max_queue=MAX_QUEUE,
+                 retries=RETRIES, on_error=None):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.on_error = on_error
+        self.failed = []  # (table name, rows, exception)
+        self.written = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='synergetic-writer', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def put(self, row, table_name=None, timeout=None):
+        """
+        Queues a row to be inserted. Blocks while the queue is full. Raises RuntimeError if the writer has been closed
+        or its background thread has stopped
+
+        :param row: A mapped instance, e.g. from create_t_attendances, or a dict of column values with table_name
+        :param table_name: Table of a dict row
+        :param timeout: Seconds to wait for space on the queue, then raise queue.Full. Waits forever when None
+        :return:
+        """
+        if self._closed:
+            raise RuntimeError("The BatchWriter has been closed")
+        self._check_alive()
+        if table_name is None:
+            table_name = row.__table__.name
+            if table_name not in TABLES:
+                raise ValueError(f"BatchWriter doesn't write {table_name}")
+            columns = row.__table__.columns.keys()
+            state = vars(row)
+            row = {col: state[col] for col in columns if state.get(col) is not None}
+        self._put((table_name, row), timeout)
+
+    def put_many(self, rows, table_name=None, timeout=None):
+        for row in rows:
+            self.put(row, table_name=table_name, timeout=timeout)
+
+    def flush(self):
+        """Blocks until every row put so far has been written (or has failed)"""
+        if self._closed:
+            raise RuntimeError("The BatchWriter has been closed")
+        self._check_alive()
+        flushed = threading.Event()
+        self._put(flushed, None)
+        while not flushed.wait(0.1):
+            self._check_alive()
+
+    def close(self):
+        """Writes everything queued and stops the background thread"""
+        if self._closed:
+            return
+        self._closed = True
+        while self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self._thread.join()
+
+    def _put(self, item, timeout):
+        # Waits in short steps so a producer blocked on a full queue finds out if the thread has died
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            step = 0.1 if deadline is None else min(0.1, max(0.0, deadline - time.monotonic()))
+            try:
+                self._queue.put(item, timeout=step)
+                return
+            except queue.Full:
+                self._check_alive()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+
+    def _check_alive(self):
+        if not self._thread.is_alive():
+            raise RuntimeError("The BatchWriter's background thread has stopped, so nothing more will be written")
+
+    def _run(self):
+        pending = {}  # (table name, columns) -> list of rows
+        oldest = None
+        while True:
+            timeout = None if oldest is None else max(0.0, self.flush_interval - (time.monotonic() - oldest))
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                # The oldest row has waited flush_interval
+                self._write_all(pending)
+                oldest = None
+                continue
+            if isinstance(item, threading.Event) or item is _STOP:
+                self._write_all(pending)
+                oldest = None
+                if item is _STOP:
+                    return
+                item.set()  # flush() is waiting on it
+                continue
+            table_name, row = item
+            rows = pending.setdefault((table_name, tuple(sorted(row))), [])
+            rows.append(row)
+            if oldest is None:
+                oldest = time.monotonic()
+            if len(rows) >= self.batch_size:
+                self._write(table_name, pending.pop((table_name, tuple(sorted(row)))))
+                if not pending:
+                    oldest = None
+
+    def _write_all(self, pending):
+        for (table_name, _), rows in list(pending.items()):
+            self._write(table_name, rows)
+        pending.clear()
+
+    def _write(self, table_name, rows):
+        table = reflection.mapped(table_name).__table__
+        delay = RETRY_BACKOFF
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    with syn.get_engine(self.engine).begin() as conn:
+                        conn.execute(table.insert(), rows)
+                    self.written += len(rows)
+                    return
+                except DBAPIError as exc:
+                    if attempt == self.retries or not is_transient(exc):
+                        self._failed(table_name, rows, exc)
+                        return
+                    logger.warning("Transient error writing %s rows to %s, retrying in %ss: %s", len(rows), table_name,
+                                   delay, exc)
+                    time.sleep(delay)
+                    delay *= 2
+        except Exception as exc:  # The thread has to keep running, or every producer blocks once the queue fills
+            self._failed(table_name, rows, exc)
+
+    def _failed(self, table_name, rows, exc):
+        self.failed.append((table_name, rows, exc))
+        if self.on_error is not None:
+            try:
+                self.on_error(table_name, rows, exc)
+            except Exception:  # A failing callback mustn't record the batch twice or stop the thread
+                logger.exception("on_error raised for %s rows to %s", len(rows), table_name)
+        else:
+            logger.error("Couldn't write %s rows to %s: %s", len(rows), table_name, exc)
+
+
+def is_transient(exc):
+    """Whether a DBAPIError is worth retrying, i.e. a dropped connection, deadlock or timeout"""
+    if exc.connection_invalidated:
+        return True
+    args = getattr(exc.orig, 'args', ())
+    return bool(args) and isinstance(args[0], str) and args[0] in TRANSIENT_SQLSTATES
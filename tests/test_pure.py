@@ -0,0 +1,205 @@
+"""
+Tests of the functions that work on plain data, so they run without a database.
+"""
+import datetime as dt
+
+import pytest
+
+from synergetic.Attendance import Analytics
+from synergetic.Attendance.Reconcile import absence_intervals, reconcile
+from synergetic.Schedule.Clashes import ClashIndex
+from synergetic.Schedule.Recurring import Recurrence
+
+DAY = dt.date(2042, 3, 14)
+
+
+def at(hour, minute=0, day=DAY):
+    return dt.datetime.combine(day, dt.time(hour, minute))
+
+
+def event(seq, time, status, absence_type='', student_id=1):
+    return {'AbsenceEventsSeq': seq, 'ID': student_id, 'EventDateTime': time, 'SchoolInOutStatus': status,
+            'AbsenceTypeCode': absence_type}
+
+
+def roll(seq, start, end, student_id=1, **columns):
+    row = {'AttendanceSeq': seq, 'ID': student_id, 'AttendedFlag': 1, 'PossibleAbsenceCode': '', 'LateArrivalFlag': 0,
+           'LatearrivalTime': None, 'EarlyDepartureFlag': 0, 'EarlyDepartureTime': None, 'AbsenceEventsSeq': 0,
+           'AttendanceDateTimeFrom': start, 'AttendanceDateTimeTo': end}
+    row.update(columns)
+    return row
+
+
+def lesson(seq, start, end, staff_id=0, room='', location=''):
+    return {'StaffScheduleSeq': seq, 'ScheduleDateTimeFrom': start, 'ScheduleDateTimeTo': end, 'StaffID': staff_id,
+            'Room': room, 'LocationCode': location}
+
+
+# Reconcile.absence_intervals
+
+def test_out_without_in_lasts_until_the_end_of_the_day():
+    out = event(1, at(13), 'Out')
+    assert absence_intervals([out]) == [(at(13), at(0, day=DAY + dt.timedelta(days=1)), out)]
+
+
+def test_in_without_out_starts_at_midnight():
+    sign_in = event(1, at(9, 20), 'In')
+    assert absence_intervals([sign_in]) == [(at(0), at(9, 20), sign_in)]
+
+
+def test_out_and_in_pairs_in_time_order():
+    out_1, in_1 = event(1, at(10, 10), 'Out'), event(2, at(10, 20), 'In')
+    out_2, in_2 = event(3, at(10, 40), 'Out'), event(4, at(10, 50), 'In')
+    assert absence_intervals([in_2, out_1, out_2, in_1]) == [(at(10, 10), at(10, 20), out_1),
+                                                             (at(10, 40), at(10, 50), out_2)]
+
+
+def test_out_is_closed_at_the_end_of_its_day():
+    next_day = DAY + dt.timedelta(days=1)
+    out, sign_in = event(1, at(15), 'Out'), event(2, at(9, day=next_day), 'In')
+    assert absence_intervals([out, sign_in]) == [(at(15), at(0, day=next_day), out),
+                                                 (at(0, day=next_day), at(9, day=next_day), sign_in)]
+
+
+def test_event_without_status_is_the_whole_day():
+    absent = event(1, at(8), '', 'ILL')
+    assert absence_intervals([absent]) == [(at(0), at(0, day=DAY + dt.timedelta(days=1)), absent)]
+
+
+# Reconcile.reconcile
+
+def test_out_without_in_leaves_early_then_misses_later_classes():
+    updates = reconcile([event(7, at(9, 30), 'Out', 'MED')],
+                        [roll(1, at(9), at(10)), roll(2, at(11), at(12))])
+    assert updates == [
+        {'EarlyDepartureFlag': 1, 'EarlyDepartureTime': at(9, 30), 'AbsenceEventsSeq': 7, 'AttendanceSeq': 1},
+        {'AttendedFlag': 0, 'PossibleAbsenceCode': 'MED', 'AbsenceEventsSeq': 7, 'AttendanceSeq': 2},
+    ]
+
+
+def test_in_without_out_is_a_late_arrival():
+    updates = reconcile([event(7, at(9, 20), 'In')], [roll(1, at(9), at(10)), roll(2, at(11), at(12))])
+    assert updates == [{'LateArrivalFlag': 1, 'LatearrivalTime': at(9, 20), 'AbsenceEventsSeq': 7,
+                        'AttendanceSeq': 1}]
+
+
+def test_two_intervals_inside_one_class_keep_the_first_departure():
+    events = [event(7, at(10, 10), 'Out'), event(8, at(10, 20), 'In'),
+              event(9, at(10, 40), 'Out'), event(10, at(10, 50), 'In')]
+    updates = reconcile(events, [roll(1, at(10), at(11))])
+    assert updates == [{'EarlyDepartureFlag': 1, 'EarlyDepartureTime': at(10, 10), 'AbsenceEventsSeq': 7,
+                        'AttendanceSeq': 1}]
+
+
+def test_rolls_that_already_match_are_left_out():
+    marked = roll(1, at(9), at(10), LateArrivalFlag=1, LatearrivalTime=at(9, 20), AbsenceEventsSeq=7)
+    assert reconcile([event(7, at(9, 20), 'In')], [marked]) == []
+
+
+def test_other_students_rolls_are_left_out():
+    assert reconcile([event(7, at(9, 20), 'In')], [roll(1, at(9), at(10), student_id=2)]) == []
+
+
+# Clashes.ClashIndex
+
+def test_overlapping_lessons_clash_on_a_shared_resource():
+    index = ClashIndex()
+    index.add(lesson(1, at(9), at(10), staff_id=5, room='A1'))
+    clashes = index.clashes(lesson(None, at(9, 30), at(10, 30), staff_id=5, room='B2'))
+    assert [(clash.resource, clash.value, clash.other) for clash in clashes] == [('StaffID', 5, 1)]
+
+
+def test_back_to_back_lessons_dont_clash():
+    index = ClashIndex()
+    index.add(lesson(1, at(9), at(10), staff_id=5))
+    assert index.clashes(lesson(None, at(10), at(11), staff_id=5)) == []
+    assert index.clashes(lesson(None, at(8), at(9), staff_id=5)) == []
+
+
+def test_blank_resources_dont_clash():
+    index = ClashIndex()
+    index.add(lesson(1, at(9), at(10), room=' '))
+    assert index.clashes(lesson(None, at(9), at(10), room='')) == []
+
+
+def test_a_long_lesson_is_found_past_shorter_ones():
+    index = ClashIndex()
+    index.add(lesson(1, at(8), at(12), room='HALL'))
+    index.add(lesson(2, at(9), at(9, 30), room='HALL'))
+    clashes = index.clashes(lesson(None, at(11), at(11, 30), room='HALL'))
+    assert [clash.other for clash in clashes] == [1]
+
+
+def test_removed_and_ignored_lessons_dont_clash():
+    index = ClashIndex()
+    index.add(lesson(1, at(9), at(10), staff_id=5))
+    index.add(lesson(2, at(9), at(10), room='A1'))
+    assert index.clashes(lesson(2, at(9), at(10), room='A1'), ignore={2}) == []
+    index.remove(1)
+    assert 1 not in index and len(index) == 1
+    assert index.clashes(lesson(None, at(9), at(10), staff_id=5)) == []
+
+
+def test_check_reports_proposed_lessons_clashing_with_each_other():
+    index = ClashIndex()
+    proposed = [lesson(None, at(9), at(10), room='A1'), lesson(None, at(11), at(12), room='A1'),
+                lesson(None, at(9, 30), at(10, 30), room='A1')]
+    assert [(clash.schedule, clash.other) for clash in index.check(proposed)] == [(proposed[2], 0)]
+    assert len(index) == 0
+
+
+def test_lesson_without_times_is_rejected():
+    with pytest.raises(ValueError):
+        ClashIndex().clashes({'StaffID': 5})
+
+
+# Analytics.absence_streaks
+
+@pytest.mark.skipif(Analytics.np is None, reason="numpy isn't installed")
+def test_absence_streaks_per_student_in_class_order():
+    # Student 1: absent, absent, present, absent. Student 2: absent three times, given out of order
+    rows = [(1, 1, at(9), False), (2, 1, at(10), False), (3, 1, at(11), True), (4, 1, at(12), False),
+            (5, 2, at(11), False), (6, 2, at(9), False), (7, 2, at(10), False)]
+    seqs, students, starts, attended = zip(*rows)
+    frame = Analytics.from_columns(seqs, students, attended, [False] * len(rows), [False] * len(rows),
+                                   ['ABS'] * len(rows), ['10ENG01'] * len(rows), [1] * len(rows),
+                                   [DAY] * len(rows), starts)
+    streaks = Analytics.absence_streaks(frame, min_length=2)
+    assert streaks.student_id.tolist() == [1, 2]
+    assert streaks.length.tolist() == [2, 3]
+    assert streaks.start.tolist() == [at(9), at(9)]
+    assert streaks.end.tolist() == [at(10), at(11)]
+    assert Analytics.absence_streaks(frame, min_length=1).length.tolist() == [2, 1, 3]
+
+
+# Recurring.Recurrence
+
+def test_recurrence_dates_on_weekdays_except_excluded():
+    recurrence = Recurrence(dt.date(2042, 2, 3), dt.date(2042, 2, 14), dt.time(15, 30), weekdays={1, 3},
+                            exclude={dt.date(2042, 2, 11)})
+    assert recurrence.dates() == [dt.date(2042, 2, 4), dt.date(2042, 2, 6), dt.date(2042, 2, 13)]
+
+
+def test_recurrence_defaults_to_the_weekday_of_date_from():
+    recurrence = Recurrence(dt.date(2042, 2, 5), dt.date(2042, 2, 19), dt.time(9))
+    assert recurrence.dates() == [dt.date(2042, 2, 5), dt.date(2042, 2, 12), dt.date(2042, 2, 19)]
+
+
+def test_recurrence_every_other_week_counts_from_the_week_of_date_from():
+    # date_from is a Wednesday, so the Monday of its week is skipped but the week is still the first
+    recurrence = Recurrence(dt.date(2042, 2, 5), dt.date(2042, 2, 19), dt.time(9), weekdays={0, 4}, every_weeks=2)
+    assert recurrence.dates() == [dt.date(2042, 2, 7), dt.date(2042, 2, 17)]
+
+
+def test_recurrence_follows_the_timetable_cycle():
+    cycle = {dt.date(2042, 2, 3): 1, dt.date(2042, 2, 4): 2, dt.date(2042, 2, 5): 3, dt.date(2042, 2, 6): 1}
+    recurrence = Recurrence(dt.date(2042, 2, 1), dt.date(2042, 2, 10), dt.time(9), cycle=cycle, cycle_days={1},
+                            exclude={dt.date(2042, 2, 6)})
+    assert recurrence.dates() == [dt.date(2042, 2, 3)]
+
+
+def test_recurrence_occurrences_and_empty_range():
+    recurrence = Recurrence(dt.date(2042, 2, 4), dt.date(2042, 2, 4), dt.time(15, 30),
+                            duration=dt.timedelta(minutes=30))
+    assert recurrence.occurrences() == [(at(15, 30, dt.date(2042, 2, 4)), at(16, 0, dt.date(2042, 2, 4)))]
+    assert Recurrence(dt.date(2042, 2, 4), dt.date(2042, 2, 3), dt.time(9)).dates() == []